@@ -0,0 +1,81 @@
+import os
+from typing import AsyncIterator, Iterator, List, Optional, Sequence, Tuple, Type, TypeVar
+
+from fastapi import HTTPException, Request, Response
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from pagination import ndjson_response, wants_ndjson
+
+# Largest payload accepted by the /batch endpoints
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 10000))
+# Items written (and, with NDJSON, reported) together
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", 500))
+
+Model = TypeVar("Model", bound=BaseModel)
+
+class BatchItemResult(BaseModel):
+    # Position of the item in the request body
+    index: int
+    # created/accepted, exists, invalid or failed
+    status: str
+    id: Optional[str] = None
+    detail: Optional[str] = None
+
+class BatchResult(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    results: List[BatchItemResult]
+
+SUCCESS_STATUSES = ("created", "accepted")
+
+batch_result_serializer = TypeAdapter(BatchResult)
+
+def check_batch_size(items: Sequence):
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+
+def validate_items(model: Type[Model], items: Sequence[object]) -> Tuple[List[Tuple[int, Model]], List[BatchItemResult]]:
+    """Valid items with their index, and an `invalid` result for each of the others."""
+    valid, invalid = [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, model.model_validate(item)))
+        except ValidationError as e:
+            invalid.append(BatchItemResult(index=index, status="invalid", detail=str(e.errors()[0]["msg"])))
+    return valid, invalid
+
+def drop_duplicates(items: List[Tuple[int, Model]], key: str) -> Tuple[List[Tuple[int, Model]], List[BatchItemResult]]:
+    """Keep the first item per key; the repeats are `invalid`."""
+    first, kept, repeated = {}, [], []
+    for index, item in items:
+        value = getattr(item, key)
+        if value in first:
+            repeated.append(BatchItemResult(index=index, status="invalid", id=value,
+                                            detail=f"Duplicate of item {first[value]}"))
+        else:
+            first[value] = index
+            kept.append((index, item))
+    return kept, repeated
+
+def chunks(items: Sequence, size: int = BATCH_CHUNK_SIZE) -> Iterator[Sequence]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+async def batch_response(request: Request, results: AsyncIterator[List[BatchItemResult]]) -> Response:
+    """One BatchResult at the end, or with Accept: application/x-ndjson a
+    line per item as soon as its chunk is done."""
+    if wants_ndjson(request):
+        async def rows():
+            async for chunk in results:
+                for result in chunk:
+                    yield result
+        return ndjson_response(rows(), lambda result: result.model_dump_json())
+
+    collected = [result async for chunk in results for result in chunk]
+    collected.sort(key=lambda result: result.index)
+    succeeded = sum(result.status in SUCCESS_STATUSES for result in collected)
+    content = batch_result_serializer.dump_json(BatchResult(
+        total=len(collected), succeeded=succeeded, failed=len(collected) - succeeded, results=collected
+    ))
+    return Response(content, media_type="application/json")
@@ -0,0 +1,234 @@
+"""End-to-end latency of the API without the docker-compose stack.
+
+Boots main:app in-process against local stand-ins: SQLite (aiosqlite) for
+Postgres, mongomock-motor for MongoDB, fakeredis for Redis and the
+memory:// Kafka broker, with service_processor consuming from it in the
+same event loop. Virtual users then drive a mix of logins, user searches,
+catalog reads, order creation with many services and order reads. The
+report has p50/p95/p99 latency and throughput per endpoint and is written
+as JSON with sorted keys, so two runs can be diffed directly.
+
+    pip install -r requirements-bench.txt
+    python -m benchmarks.api_bench --duration 30 --concurrency 32 --output baseline.json
+
+The numbers are for comparing versions of this code on one machine; the
+stand-ins do not behave like the real databases under load. /users/search
+uses the in-process n-gram backend, since SQLite has no pg_trgm.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+# Must be set before the app modules read them at import time
+os.environ.setdefault("KAFKA_BOOTSTRAP_SERVERS", "memory://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("USER_SEARCH_BACKEND", "ngram")
+# The processor runs in this process and shares the API's /metrics
+os.environ.setdefault("SERVICE_METRICS_PORT", "0")
+
+from benchmarks.user_search_bench import MASKS, generate_users, percentiles
+
+PASSWORD = "benchmark"
+
+# Share of each operation in the mix
+OPERATION_WEIGHTS = {
+    "POST /token": 5,
+    "GET /users/search": 15,
+    "GET /services": 25,
+    "POST /services": 5,
+    "POST /orders": 15,
+    "GET /orders": 20,
+    "GET /orders/{order_id}": 15,
+}
+
+class Recorder:
+    def __init__(self):
+        self.reset()
+
+    def reset(self, duration: float = float("inf")):
+        self.started_at = time.perf_counter()
+        self.stops_at = self.started_at + duration
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, name: str, started: float, failed: bool):
+        # Requests still running when the window closes are left out
+        finished = time.perf_counter()
+        if finished <= self.stops_at:
+            self.samples[name].append(finished - started)
+            self.errors[name] += failed
+
+    def report(self) -> dict:
+        elapsed = min(time.perf_counter(), self.stops_at) - self.started_at
+        endpoints = {}
+        for name, samples in self.samples.items():
+            endpoints[name] = dict(
+                percentiles(samples),
+                requests=len(samples),
+                errors=self.errors[name],
+                throughput_rps=round(len(samples) / elapsed, 1),
+            )
+        every = [sample for samples in self.samples.values() for sample in samples]
+        total = dict(
+            percentiles(every) if every else {},
+            requests=len(every),
+            errors=sum(self.errors.values()),
+            throughput_rps=round(len(every) / elapsed, 1),
+        )
+        return {"elapsed_seconds": round(elapsed, 2), "endpoints": endpoints, "total": total}
+
+def install_stand_ins(sqlite_path: str):
+    """Point the app's module-level clients at the stand-ins; call before importing main."""
+    import fakeredis
+    import fakeredis.aioredis
+    from mongomock_motor import AsyncMongoMockClient
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from db import database, mongodb
+    from db.instrumentation import instrument_engine
+    from db.redis_client import redis_client
+
+    redis_server = fakeredis.FakeServer()
+    redis_client.client = fakeredis.aioredis.FakeRedis(server=redis_server)
+    redis_client.pubsub_client = fakeredis.aioredis.FakeRedis(server=redis_server)
+
+    mongodb.client = AsyncMongoMockClient()
+    mongodb.db = mongodb.client[mongodb.MONGODB_DB]
+    mongodb.services_collection = mongodb.db.services
+    mongodb.orders_collection = mongodb.db.orders
+    mongodb.user_order_stats_collection = mongodb.db.user_order_stats
+
+    database.engine = create_async_engine(f"sqlite+aiosqlite:///{sqlite_path}")
+    instrument_engine(database.engine)
+    database.SessionLocal.configure(bind=database.engine)
+
+async def seed(user_count: int, service_count: int, rng: random.Random):
+    from db import database
+    from db.models import User
+    from db.mongodb import ServiceMongo, upsert_services
+    from password_hashing import pwd_context
+
+    # Only the users table: the other ORM tables use Postgres-only types
+    async with database.engine.begin() as connection:
+        await connection.run_sync(User.__table__.create, checkfirst=True)
+
+    # One bcrypt hash for everybody; hashing is measured through /token
+    hashed_password = pwd_context.hash(PASSWORD)
+    users = generate_users(user_count)
+    async with database.SessionLocal() as db:
+        db.add_all(
+            User(username=username, full_name=full_name, hashed_password=hashed_password, disabled=disabled)
+            for username, full_name, disabled in users
+        )
+        await db.commit()
+
+    services = [
+        ServiceMongo(name=f"Service {i}", description="benchmark", price=round(rng.uniform(10, 20000), 2))
+        for i in range(service_count)
+    ]
+    await upsert_services(services)
+    return [username for username, _, _ in users], [service.id for service in services]
+
+async def virtual_user(client, recorder: Recorder, rng: random.Random, usernames: List[str],
+                       service_ids: List[str], order_size: int, deadline: float):
+    async def call(name: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        recorder.record(name, started, response.status_code >= 400)
+        return response
+
+    username = rng.choice(usernames)
+    login = {"username": username, "password": PASSWORD}
+    response = await call("POST /token", "POST", "/token", data=login)
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    catalog_etag = None
+    order_ids: List[str] = []
+
+    operations, weights = zip(*OPERATION_WEIGHTS.items())
+    while time.monotonic() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        if operation == "POST /token":
+            await call(operation, "POST", "/token", data=login)
+        elif operation == "GET /users/search":
+            await call(operation, "GET", "/users/search", params={"name_mask": rng.choice(MASKS)}, headers=headers)
+        elif operation == "GET /services":
+            # Half of the pollers revalidate the catalog they already have
+            conditional = {"If-None-Match": catalog_etag} if catalog_etag and rng.random() < 0.5 else {}
+            response = await call(operation, "GET", "/services", headers={**headers, **conditional})
+            catalog_etag = response.headers.get("etag", catalog_etag)
+        elif operation == "POST /services":
+            service = {"name": "Benchmark service", "description": "benchmark", "price": rng.uniform(10, 20000)}
+            await call(operation, "POST", "/services", json=service, headers=headers)
+        elif operation == "POST /orders":
+            order = {"services": rng.sample(service_ids, min(order_size, len(service_ids)))}
+            response = await call(operation, "POST", "/orders", json=order, headers=headers)
+            if response.status_code == 200:
+                order_ids.append(response.json()["id"])
+        elif operation == "GET /orders":
+            await call(operation, "GET", "/orders", params={"limit": 20}, headers=headers)
+        elif order_ids:
+            await call(operation, "GET", f"/orders/{rng.choice(order_ids)}", headers=headers)
+
+async def run(args) -> dict:
+    import httpx
+
+    sqlite_path = os.path.join(tempfile.mkdtemp(prefix="api_bench_"), "bench.db")
+    install_stand_ins(sqlite_path)
+    import main
+    from service_processor import process_service_commands
+
+    rng = random.Random(args.seed)
+    usernames, service_ids = await seed(args.users, args.services, rng)
+
+    recorder = Recorder()
+    async with main.app.router.lifespan_context(main.app):
+        processor = asyncio.create_task(process_service_commands())
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            deadline = time.monotonic() + args.warmup + args.duration
+
+            async def start_measuring():
+                await asyncio.sleep(args.warmup)
+                recorder.reset(args.duration)
+
+            await asyncio.gather(start_measuring(), *[
+                virtual_user(client, recorder, random.Random(rng.random()), usernames, service_ids,
+                             args.order_size, deadline)
+                for _ in range(args.concurrency)
+            ])
+        report = recorder.report()
+        processor.cancel()
+        try:
+            await processor
+        except asyncio.CancelledError:
+            pass
+
+    report["config"] = {key: value for key, value in vars(args).items() if key != "output"}
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    parser.add_argument("--concurrency", type=int, default=32, help="virtual users")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--services", type=int, default=1_000)
+    parser.add_argument("--order-size", type=int, default=20, help="services per created order")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(run(args)), indent=2, sort_keys=True)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Throughput of the GET /services response path on a 10k-service list.
+
+Compares the path FastAPI takes with a response_model (ServiceMongo per
+document, revalidation into Service, jsonable_encoder, stdlib json or
+orjson) with json_list_response, which validates the raw Mongo documents
+and dumps them in a single pydantic-core call.
+
+    python -m benchmarks.serialization_bench --services 10000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from db.mongodb import ServiceMongo
+from main import Service, services_serializer
+from pagination import json_list_response
+
+def generate_documents(count: int, seed: int = 42) -> List[dict]:
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1)
+    return [
+        {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "name": f"Service {i}",
+            "description": "Описание услуги " * rng.randint(1, 8),
+            "price": round(rng.uniform(10, 20000), 2),
+            "created_at": started + timedelta(seconds=i),
+        }
+        for i in range(count)
+    ]
+
+async def measure(render: Callable, documents: List[dict], iterations: int) -> Dict[str, float]:
+    samples = []
+    size = 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        size = len(await render(documents))
+        samples.append(time.perf_counter() - started)
+    best = min(samples)
+    return {
+        "best_ms": round(best * 1000, 2),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+        "rows_per_second": round(len(documents) / best),
+        "bytes": size,
+    }
+
+async def main_async(count: int, iterations: int) -> dict:
+    documents = generate_documents(count)
+    field = create_response_field(name="Response_get_services", type_=List[Service])
+
+    def response_model_path(response_class):
+        async def render(docs):
+            content = await serialize_response(
+                field=field, response_content=[ServiceMongo(**doc) for doc in docs], is_coroutine=True
+            )
+            return response_class(content).body
+        return render
+
+    async def fast_path(docs):
+        return json_list_response(services_serializer, docs).body
+
+    report = {
+        "response_model_json": await measure(response_model_path(JSONResponse), documents, iterations),
+        "response_model_orjson": await measure(response_model_path(ORJSONResponse), documents, iterations),
+        "json_list_response": await measure(fast_path, documents, iterations),
+    }
+    baseline = report["response_model_json"]["best_ms"]
+    for result in report.values():
+        result["speedup"] = round(baseline / result["best_ms"], 2)
+    return {"services": count, "iterations": iterations, "paths": report}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", type=int, default=10_000)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main_async(args.services, args.iterations)), indent=2))
+
+if __name__ == "__main__":
+    main()
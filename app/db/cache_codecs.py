@@ -0,0 +1,105 @@
+import zlib
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Optional, Sequence, Type
+
+import msgpack
+from pydantic import BaseModel
+
+_DATETIME_EXT = 1
+
+def _default(obj: Any):
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(_DATETIME_EXT, obj.isoformat().encode())
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+def _ext_hook(code: int, data: bytes):
+    if code == _DATETIME_EXT:
+        return datetime.fromisoformat(data.decode())
+    return msgpack.ExtType(code, data)
+
+def packb(value: Any) -> bytes:
+    return msgpack.packb(value, default=_default, use_bin_type=True)
+
+def unpackb(data: bytes) -> Any:
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False)
+
+class Codec(ABC):
+    """Кодек значений кэша: объект <-> bytes"""
+
+    @abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        ...
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        ...
+
+class MsgpackCodec(Codec):
+    """Кодек для простых данных (dict, list, строки, числа, datetime)"""
+
+    def dumps(self, value: Any) -> bytes:
+        return packb(value)
+
+    def loads(self, data: bytes) -> Any:
+        return unpackb(data)
+
+class _RowCodec(Codec):
+    """
+    Кодек объектов с фиксированным набором полей.
+
+    Объект хранится как список значений полей без имён, список объектов -
+    как список таких строк. В payload кладётся отпечаток набора полей, чтобы
+    после изменения схемы старые записи считались промахом, а не ломали чтение.
+    """
+
+    def __init__(self, fields: Sequence[str]):
+        self.fields = tuple(fields)
+        self.fingerprint = zlib.crc32(",".join(self.fields).encode())
+
+    def to_row(self, obj: Any) -> list:
+        return [getattr(obj, field) for field in self.fields]
+
+    @abstractmethod
+    def from_row(self, row: list) -> Any:
+        ...
+
+    def dumps(self, value: Any) -> bytes:
+        if isinstance(value, list):
+            return packb([self.fingerprint, 1, [self.to_row(item) for item in value]])
+        return packb([self.fingerprint, 0, self.to_row(value)])
+
+    def loads(self, data: bytes) -> Any:
+        fingerprint, many, payload = unpackb(data)
+        if fingerprint != self.fingerprint:
+            raise ValueError("Cached payload was written with a different schema")
+        if many:
+            return [self.from_row(row) for row in payload]
+        return self.from_row(payload)
+
+class PydanticCodec(_RowCodec):
+    """Кодек для Pydantic-моделей"""
+
+    def __init__(self, model: Type[BaseModel]):
+        super().__init__(model.model_fields.keys())
+        self.model = model
+
+    def from_row(self, row: list) -> BaseModel:
+        return self.model.model_validate(dict(zip(self.fields, row)))
+
+class OrmCodec(_RowCodec):
+    """
+    Кодек для ORM-моделей SQLAlchemy.
+
+    Восстанавливает несвязанный с сессией экземпляр модели, у которого
+    доступны все колонки таблицы.
+    """
+
+    def __init__(self, model: Type[Any], fields: Optional[Sequence[str]] = None):
+        super().__init__(fields or model.__table__.columns.keys())
+        self.model = model
+
+    def from_row(self, row: list) -> Any:
+        return self.model(**dict(zip(self.fields, row)))
+
+default_codec = MsgpackCodec()
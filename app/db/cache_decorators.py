@@ -1,57 +1,295 @@
+import asyncio
+import inspect
+import math
+import os
+import random
+import struct
+import time
+import uuid
 from functools import wraps
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Dict, Optional, Sequence, Set, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import SessionLocal
 from .redis_client import redis_client
+from .tiered_cache import key_prefix, tiered_cache
+from .cache_codecs import Codec, default_codec
+from .cache_invalidation import get_namespace_versions, invalidate_namespaces
 
-def cache_read_through(prefix: str, ttl: Optional[int] = None):
+_SIMPLE_TYPES = (str, int, float, bool, type(None))
+
+LOCK_KEY_PREFIX = "lock"
+# Блокировка истекает сама, если загрузивший её воркер упал
+LOCK_TTL_MS = int(os.getenv("CACHE_LOCK_TTL_MS", 5000))
+# Сколько ждать значения от владельца блокировки, прежде чем грузить самим
+LOCK_WAIT_SECONDS = float(os.getenv("CACHE_LOCK_WAIT", 2))
+LOCK_POLL_INTERVAL = 0.05
+
+# Конверт записи с мягким TTL: маркер, срок свежести и время вычисления.
+# 0xc1 не используется в msgpack, поэтому запись без конверта (например,
+# положенная cache_write_through) с маркером не спутать
+_ENVELOPE_MARKER = b"\xc1swr"
+_ENVELOPE_HEADER = struct.Struct(">dd")
+
+_MISS = object()
+# Ссылки на фоновые обновления, чтобы их не собрал сборщик мусора
+_background_tasks: Set[asyncio.Task] = set()
+
+class _LoaderGone(Exception):
+    """Запрос, загружавший значение для остальных, был отменён"""
+
+def _wrap(payload: bytes, fresh_until: float, compute_seconds: float) -> bytes:
+    return _ENVELOPE_MARKER + _ENVELOPE_HEADER.pack(fresh_until, compute_seconds) + payload
+
+def _unwrap(data: bytes) -> Tuple[bytes, Optional[float], float]:
+    if not data.startswith(_ENVELOPE_MARKER):
+        return data, None, 0.0
+    offset = len(_ENVELOPE_MARKER)
+    fresh_until, compute_seconds = _ENVELOPE_HEADER.unpack_from(data, offset)
+    return data[offset + _ENVELOPE_HEADER.size:], fresh_until, compute_seconds
+
+def _replace_sessions(args: tuple, kwargs: dict, db: AsyncSession) -> Tuple[tuple, dict]:
+    args = tuple(db if isinstance(arg, AsyncSession) else arg for arg in args)
+    kwargs = {name: db if isinstance(value, AsyncSession) else value for name, value in kwargs.items()}
+    return args, kwargs
+
+async def drain_background_tasks(timeout: float):
+    """Ожидание фоновых обновлений кэша перед закрытием соединений"""
+    if _background_tasks:
+        await asyncio.wait(set(_background_tasks), timeout=timeout)
+
+def build_cache_key(prefix: str, *parts: Any) -> str:
+    """Ключ кэша вида prefix:part1:part2"""
+    return ":".join([prefix, *(str(part) for part in parts)])
+
+def make_key_builder(func: Callable, key: Optional[Sequence[str]] = None) -> Callable:
+    """
+    Строит функцию, вычисляющую часть ключа кэша из аргументов вызова.
+
+    Args:
+        func: Декорируемая функция
+        key: Имена аргументов, входящих в ключ. Если не заданы, в ключ
+            попадают все аргументы простых типов, а инфраструктурные
+            (сессия БД, клиенты) игнорируются
+    """
+    signature = inspect.signature(func)
+
+    def build(*args, **kwargs) -> list:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        if key is not None:
+            return [bound.arguments[name] for name in key]
+        return [
+            value for value in bound.arguments.values()
+            if isinstance(value, _SIMPLE_TYPES)
+        ]
+    return build
+
+def cache_read_through(
+    prefix: str,
+    ttl: Optional[int] = None,
+    key: Optional[Sequence[str]] = None,
+    codec: Codec = default_codec,
+    namespaces: Sequence[str] = (),
+    stale_ttl: Optional[int] = None,
+    early_expiration: float = 0.0,
+    lock: bool = False,
+):
     """
     Декоратор для реализации паттерна сквозного чтения (Cache-Aside)
-    
+
+    Одновременные промахи по одному ключу в процессе объединяются: функцию
+    вызывает один запрос, остальные ждут его результата.
+
     Args:
         prefix: Префикс для ключа кэша
         ttl: Время жизни кэша в секундах
+        key: Имена аргументов функции, из которых строится ключ кэша
+        codec: Кодек для сериализации результата
+        namespaces: Пространства имён, при инвалидации которых запись
+            перестаёт быть видимой
+        stale_ttl: Сколько секунд после истечения ttl запись ещё отдаётся
+            (stale-while-revalidate), пока одна фоновая задача её обновляет
+        early_expiration: Коэффициент beta вероятностного досрочного
+            обновления (XFetch); 0 - выключено. Чем дольше вычисляется
+            значение, тем раньше до истечения ttl начинается обновление
+        lock: Загружать значение при промахе только в одном воркере
+            (блокировка в Redis); остальные ждут, пока оно появится в кэше
     """
+    use_envelope = stale_ttl is not None or early_expiration > 0
+    fresh_ttl = ttl or redis_client.default_ttl
+
     def decorator(func: Callable):
+        key_builder = make_key_builder(func, key)
+        # Загрузки, идущие сейчас в этом процессе, по ключу кэша
+        in_flight: Dict[str, asyncio.Future] = {}
+        refreshing: Set[str] = set()
+
+        async def make_cache_key(*args, **kwargs) -> str:
+            parts = key_builder(*args, **kwargs)
+            if namespaces:
+                versions = await get_namespace_versions(namespaces)
+                parts.insert(0, "v" + ".".join(str(version) for version in versions))
+            return build_cache_key(prefix, *parts)
+
+        async def store(cache_key: str, result: Any, compute_seconds: float):
+            payload = codec.dumps(result)
+            if use_envelope:
+                payload = _wrap(payload, time.time() + fresh_ttl, compute_seconds)
+                await tiered_cache.set(cache_key, payload, fresh_ttl + (stale_ttl or 0))
+            else:
+                await tiered_cache.set(cache_key, payload, ttl)
+
+        def decode(cached: bytes) -> Tuple[Any, bool]:
+            """Значение записи и признак того, что её пора обновить"""
+            payload, fresh_until, compute_seconds = _unwrap(cached)
+            result = codec.loads(payload)
+            if fresh_until is None:
+                return result, False
+            now = time.time()
+            if early_expiration > 0:
+                # XFetch: now - delta * beta * ln(rand) >= expiry
+                now -= compute_seconds * early_expiration * math.log(1.0 - random.random())
+            return result, now >= fresh_until
+
+        async def fill(cache_key: str, args, kwargs, wait_for_lock: bool = True):
+            """Вызов функции и запись результата; _MISS, если загрузку взял другой воркер"""
+            lock_key = build_cache_key(LOCK_KEY_PREFIX, cache_key)
+            token = uuid.uuid4().hex if lock else None
+            acquired = await redis_client.acquire_lock(lock_key, token, LOCK_TTL_MS) if token else None
+            if not acquired:
+                token = None
+            # None - Redis недоступен: ждать некого, загружаем сразу
+            if acquired is False:
+                if not wait_for_lock:
+                    # Обновляет другой воркер; убираем свою копию из L1, чтобы
+                    # следующее чтение взяло из Redis уже обновлённую запись
+                    tiered_cache.local(key_prefix(cache_key)).delete(cache_key)
+                    return _MISS
+                cached = await wait_for_value(cache_key)
+                if cached is not _MISS:
+                    return cached
+                # Владелец блокировки не успел - загружаем сами
+            try:
+                started = time.perf_counter()
+                result = await func(*args, **kwargs)
+                if result is not None:
+                    await store(cache_key, result, time.perf_counter() - started)
+                return result
+            finally:
+                if token is not None:
+                    await redis_client.release_lock(lock_key, token)
+
+        async def wait_for_value(cache_key: str):
+            deadline = time.monotonic() + LOCK_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+                cached = await tiered_cache.get(cache_key)
+                if cached is not None:
+                    try:
+                        return decode(cached)[0]
+                    except Exception:
+                        return _MISS
+            return _MISS
+
+        async def load(cache_key: str, args, kwargs):
+            # Single-flight: функцию вызывает первый запрос (в своём контексте,
+            # со своей сессией БД), остальные ждут его future
+            while cache_key in in_flight:
+                try:
+                    return await asyncio.shield(in_flight[cache_key])
+                except _LoaderGone:
+                    continue
+
+            future = asyncio.get_running_loop().create_future()
+            in_flight[cache_key] = future
+            try:
+                result = await fill(cache_key, args, kwargs)
+            except BaseException as e:
+                # Отмену первого запроса ожидающие переживают и грузят сами
+                future.set_exception(e if isinstance(e, Exception) else _LoaderGone())
+                future.exception()  # ожидающих может не быть - не логируем
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                in_flight.pop(cache_key, None)
+
+        async def refresh(cache_key: str, args, kwargs):
+            try:
+                # Сессия запроса закроется вместе с ним - фоновой задаче нужна своя
+                async with SessionLocal() as db:
+                    args, kwargs = _replace_sessions(args, kwargs, db)
+                    await fill(cache_key, args, kwargs, wait_for_lock=False)
+            except Exception as e:
+                print(f"Error refreshing cache key {cache_key}: {e}")
+            finally:
+                refreshing.discard(cache_key)
+
+        def schedule_refresh(cache_key: str, args, kwargs):
+            if cache_key in refreshing or cache_key in in_flight:
+                return
+            refreshing.add(cache_key)
+            task = asyncio.ensure_future(refresh(cache_key, args, kwargs))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
             # Формируем ключ кэша
-            cache_key = f"{prefix}:{str(args)}:{str(kwargs)}"
-            
+            cache_key = await make_cache_key(*args, **kwargs)
+
             # Пробуем получить данные из кэша
-            cached_data = redis_client.get(cache_key)
+            cached_data = await tiered_cache.get(cache_key)
             if cached_data is not None:
-                return cached_data
-            
+                try:
+                    result, expired = decode(cached_data)
+                except Exception:
+                    # Повреждённая или устаревшая по схеме запись - считаем промахом
+                    pass
+                else:
+                    # Устаревшую запись отдаём сразу, обновляем в фоне
+                    if expired:
+                        schedule_refresh(cache_key, args, kwargs)
+                    return result
+
             # Если данных нет в кэше, получаем их из БД
-            result = await func(*args, **kwargs)
-            
-            # Сохраняем результат в кэш
-            if result is not None:
-                redis_client.set(cache_key, result, ttl)
-            
-            return result
+            return await load(cache_key, args, kwargs)
         return wrapper
     return decorator
 
-def cache_write_through(prefix: str, invalidate_pattern: Optional[str] = None):
+def cache_write_through(
+    prefix: str,
+    invalidates: Sequence[str] = (),
+    key: Optional[Callable[[Any], Any]] = None,
+    codec: Codec = default_codec,
+    ttl: Optional[int] = None,
+):
     """
     Декоратор для реализации паттерна сквозной записи (Write-Through)
-    
+
     Args:
         prefix: Префикс для ключа кэша
-        invalidate_pattern: Паттерн ключей для инвалидации кэша
+        invalidates: Пространства имён, инвалидируемые после записи
+        key: Функция, вычисляющая часть ключа кэша из результата записи.
+            Если задана, результат сразу кладётся в кэш
+        codec: Кодек для сериализации результата
+        ttl: Время жизни кэша в секундах
     """
     def decorator(func: Callable):
         @wraps(func)
         async def wrapper(*args, **kwargs):
             # Выполняем операцию записи
             result = await func(*args, **kwargs)
-            
+
+            # Кладём записанное значение в кэш
+            if key is not None and result is not None:
+                cache_key = build_cache_key(prefix, key(result))
+                await tiered_cache.set(cache_key, codec.dumps(result), ttl, broadcast=True)
+
             # Инвалидируем кэш
-            if invalidate_pattern:
-                pattern = f"{prefix}:{invalidate_pattern}"
-                # Здесь можно добавить логику для удаления ключей по паттерну
-                # Например, используя SCAN и DEL в Redis
-            
+            await invalidate_namespaces(*invalidates)
+
             return result
         return wrapper
-    return decorator 
\ No newline at end of file
+    return decorator
@@ -0,0 +1,40 @@
+from typing import List, Sequence
+from .redis_client import redis_client
+from .tiered_cache import tiered_cache
+
+NAMESPACE_KEY_PREFIX = "cache_ns"
+
+# Версии читаются при каждом обращении к кэшу пространства, поэтому держим их
+# в L1; короткий TTL страхует от потерянных сообщений pub/sub
+tiered_cache.configure(NAMESPACE_KEY_PREFIX, max_entries=1024, max_bytes=64 * 1024, ttl=5)
+
+def namespace_key(namespace: str) -> str:
+    return f"{NAMESPACE_KEY_PREFIX}:{namespace}"
+
+async def get_namespace_versions(namespaces: Sequence[str]) -> List[int]:
+    """
+    Текущие версии (поколения) пространств имён кэша.
+
+    Версия входит в ключ каждой закэшированной записи пространства, поэтому
+    после увеличения версии читатели перестают видеть старые записи, а те
+    сами истекают по TTL. Отсутствующий счётчик соответствует версии 0.
+    """
+    if not namespaces:
+        return []
+    raw = await tiered_cache.get_many([namespace_key(namespace) for namespace in namespaces])
+    return [int(value) if value is not None else 0 for value in raw]
+
+async def invalidate_namespaces(*namespaces: str) -> bool:
+    """
+    Инвалидация всех записей пространств имён за O(1).
+
+    В отличие от удаления по паттерну (KEYS/SCAN + DEL) стоимость не зависит
+    от числа ключей: увеличивается только счётчик версии.
+    """
+    if not namespaces:
+        return True
+    keys = [namespace_key(namespace) for namespace in namespaces]
+    bumped = await redis_client.incr_many(keys)
+    # Версии кэшируются в L1 воркеров - сообщаем им о новом поколении
+    await tiered_cache.invalidate(*keys)
+    return bumped
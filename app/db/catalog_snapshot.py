@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import os
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from .cache_invalidation import get_namespace_versions
+from .mongodb import find_service_documents
+from .redis_client import redis_client
+
+CATALOG_NAMESPACE = "services"
+# One key, overwritten on every version: a bulk import bumps the version
+# hundreds of times and must not leave a copy of the catalog per bump
+CATALOG_SNAPSHOT_KEY = "catalog_snapshot"
+CATALOG_SNAPSHOT_TTL = int(os.getenv("CATALOG_SNAPSHOT_TTL", 3600))
+
+class Snapshot(NamedTuple):
+    version: int
+    etag: str
+    body: bytes
+
+def make_etag(version: int, body: bytes) -> str:
+    # The digest keeps tags unique if the Redis counter is ever reset
+    return f'"{version}-{hashlib.sha1(body).hexdigest()[:16]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+class CatalogSnapshot:
+    """The full services list, serialized once per catalog version.
+
+    The version is the "services" cache namespace, which service_processor
+    bumps after every persisted batch. Reading it is an L1 hit most of the
+    time, so an unchanged catalog costs neither Redis nor MongoDB. After a
+    change the first worker to ask renders the list from MongoDB and shares
+    it through Redis, as "<version>\n<body>" under a single key; the other
+    workers only fetch the bytes.
+    """
+
+    def __init__(self, render: Callable[[List[dict]], bytes], ttl: int = CATALOG_SNAPSHOT_TTL):
+        self.render = render
+        self.ttl = ttl
+        self._snapshot: Optional[Snapshot] = None
+        self._loading: Optional[asyncio.Future] = None
+        self._loading_version: Optional[int] = None
+
+    async def get(self) -> Snapshot:
+        version = (await get_namespace_versions([CATALOG_NAMESPACE]))[0]
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        # Requests arriving while a version is loading wait for that load
+        if self._loading is None or self._loading_version != version:
+            self._loading_version = version
+            self._loading = asyncio.ensure_future(self._load(version))
+        return await asyncio.shield(self._loading)
+
+    @staticmethod
+    def _parse(value: Optional[bytes]) -> Tuple[Optional[int], Optional[bytes]]:
+        if value is None:
+            return None, None
+        version, _, body = value.partition(b"\n")
+        return int(version), body
+
+    async def _load(self, version: int) -> Snapshot:
+        try:
+            stored_version, body = self._parse(await redis_client.get_bytes(CATALOG_SNAPSHOT_KEY))
+            if stored_version != version:
+                # Rendered after the version was read, so the body is never
+                # older than the version it is labelled with
+                body = self.render(await find_service_documents())
+                # A worker still on an older version must not replace a newer snapshot
+                if stored_version is None or stored_version < version:
+                    await redis_client.set_bytes(CATALOG_SNAPSHOT_KEY, b"%d\n%s" % (version, body), self.ttl)
+        except Exception:
+            # Let the next request retry instead of replaying this failure
+            if self._loading_version == version:
+                self._loading = None
+            raise
+        snapshot = Snapshot(version, make_etag(version, body), body)
+        if self._snapshot is None or self._snapshot.version <= version:
+            self._snapshot = snapshot
+        return snapshot
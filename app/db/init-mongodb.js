@@ -70,4 +70,11 @@ db.orders.insertMany([
         total_price: 1050.00,
         created_at: new Date()
     }
-]); 
\ No newline at end of file
+]);
+
+// Indexes for the lookups in db/mongodb.py (kept in sync with db/mongo_indexes.py)
+db.services.createIndex({ id: 1 }, { name: "services_id_unique", unique: true });
+db.orders.createIndex({ id: 1 }, { name: "orders_id_unique", unique: true });
+db.orders.createIndex({ user_id: 1, created_at: 1, id: 1 }, { name: "orders_user_id_created_at_id" });
+db.orders.createIndex({ "items.id": 1 }, { name: "orders_items_id" });
+db.user_order_stats.createIndex({ user_id: 1 }, { name: "user_order_stats_user_id_unique", unique: true });
@@ -0,0 +1,66 @@
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Optional
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event
+
+# From a local Redis GET to a slow aggregation or a bcrypt round
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+BACKEND_LATENCY = Histogram(
+    "backend_operation_seconds", "Latency of calls to Redis, MongoDB, Postgres and Kafka",
+    ["backend", "operation"], buckets=LATENCY_BUCKETS,
+)
+BACKEND_ERRORS = Counter(
+    "backend_operation_errors_total", "Calls to a backend that raised",
+    ["backend", "operation"],
+)
+
+@contextmanager
+def timed(backend: str, operation: str):
+    """Record the duration of the enclosed block, including awaits inside it."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        BACKEND_ERRORS.labels(backend, operation).inc()
+        raise
+    finally:
+        BACKEND_LATENCY.labels(backend, operation).observe(time.perf_counter() - started)
+
+def instrumented(backend: str, operation: Optional[str] = None):
+    """Time every call of an async function; the operation defaults to its name."""
+    def decorator(func: Callable):
+        name = operation or func.__name__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with timed(backend, name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def instrument_engine(engine):
+    """Time every statement of an (async) SQLAlchemy engine by its SQL verb."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        BACKEND_LATENCY.labels("postgres", _verb(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+        BACKEND_ERRORS.labels("postgres", _verb(context.statement or "")).inc()
+
+def _verb(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "unknown"
@@ -1,21 +1,107 @@
-from kafka import KafkaProducer, KafkaConsumer
+from aiokafka import AIOKafkaConsumer, AIOKafkaProducer
+from typing import Optional
+import asyncio
 import json
 import os
 
 KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092')
+# memory:// runs against the in-process broker from db.kafka_memory
+KAFKA_IN_MEMORY = KAFKA_BOOTSTRAP_SERVERS.startswith('memory://')
 SERVICE_TOPIC = 'service_commands'
+SERVICE_CONSUMER_GROUP = os.getenv('SERVICE_CONSUMER_GROUP', 'service_processor')
 
-def get_kafka_producer():
-    return KafkaProducer(
-        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-        value_serializer=lambda v: json.dumps(v).encode('utf-8')
-    )
+# Producer batching: wait up to linger_ms for more records to join a batch
+KAFKA_PRODUCER_LINGER_MS = int(os.getenv('KAFKA_PRODUCER_LINGER_MS', 5))
+KAFKA_PRODUCER_BATCH_SIZE = int(os.getenv('KAFKA_PRODUCER_BATCH_SIZE', 64 * 1024))
+KAFKA_PRODUCER_COMPRESSION = os.getenv('KAFKA_PRODUCER_COMPRESSION', 'gzip') or None
+KAFKA_PRODUCER_ACKS = os.getenv('KAFKA_PRODUCER_ACKS', 'all')
+
+_producer: Optional[AIOKafkaProducer] = None
+_producer_lock: Optional[asyncio.Lock] = None
+
+def _serialize(value):
+    return json.dumps(value).encode('utf-8')
+
+def _serialize_key(key):
+    return key.encode('utf-8')
+
+async def get_kafka_producer() -> AIOKafkaProducer:
+    """Return the process-wide producer, connecting it on first use."""
+    global _producer, _producer_lock
+    if _producer is not None:
+        return _producer
+    if _producer_lock is None:
+        # created lazily so it binds to the running loop
+        _producer_lock = asyncio.Lock()
+    async with _producer_lock:
+        if _producer is None:
+            acks = int(KAFKA_PRODUCER_ACKS) if KAFKA_PRODUCER_ACKS.isdigit() else KAFKA_PRODUCER_ACKS
+            producer_class = AIOKafkaProducer
+            options = {'bootstrap_servers': KAFKA_BOOTSTRAP_SERVERS}
+            if KAFKA_IN_MEMORY:
+                from .kafka_memory import InMemoryProducer, memory_broker
+                producer_class, options = InMemoryProducer, {'broker': memory_broker}
+            producer = producer_class(
+                value_serializer=_serialize,
+                key_serializer=_serialize_key,
+                linger_ms=KAFKA_PRODUCER_LINGER_MS,
+                max_batch_size=KAFKA_PRODUCER_BATCH_SIZE,
+                compression_type=KAFKA_PRODUCER_COMPRESSION,
+                acks=acks,
+                # Kafka orders records per partition; commands for one
+                # service id must not be reordered by retries
+                enable_idempotence=acks == 'all',
+                **options
+            )
+            try:
+                await producer.start()
+            except BaseException:
+                # Also when the caller's timeout cancels start(): a producer
+                # left half-started keeps its connections and background tasks
+                await producer.stop()
+                raise
+            _producer = producer
+    return _producer
+
+def kafka_producer_started() -> bool:
+    """Whether the process-wide producer is connected; never connects it."""
+    return _producer is not None
 
-def get_kafka_consumer():
-    return KafkaConsumer(
+async def stop_kafka_producer():
+    """Deliver everything still buffered and close the producer."""
+    global _producer
+    if _producer is not None:
+        producer, _producer = _producer, None
+        await producer.stop()
+
+def _deserialize_key(key):
+    return key.decode('utf-8', errors='replace') if key is not None else None
+
+def _deserialize(data):
+    # A malformed command must not break the whole fetch; it is skipped later
+    try:
+        return json.loads(data.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+def get_kafka_consumer(max_poll_records: int = 500):
+    """Group consumer with manual offset commits; call start() before use.
+
+    Every service_processor replica joins SERVICE_CONSUMER_GROUP, so the
+    topic's partitions are spread across replicas.
+    """
+    consumer_class = AIOKafkaConsumer
+    options = {'bootstrap_servers': KAFKA_BOOTSTRAP_SERVERS}
+    if KAFKA_IN_MEMORY:
+        from .kafka_memory import InMemoryConsumer, memory_broker
+        consumer_class, options = InMemoryConsumer, {'broker': memory_broker}
+    return consumer_class(
         SERVICE_TOPIC,
-        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-        value_deserializer=lambda x: json.loads(x.decode('utf-8')),
+        group_id=SERVICE_CONSUMER_GROUP,
+        key_deserializer=_deserialize_key,
+        value_deserializer=_deserialize,
         auto_offset_reset='earliest',
-        enable_auto_commit=True
-    ) 
\ No newline at end of file
+        enable_auto_commit=False,
+        max_poll_records=max_poll_records,
+        **options
+    )
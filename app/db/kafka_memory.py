@@ -0,0 +1,180 @@
+"""In-process stand-in for a Kafka cluster.
+
+Implements the part of the aiokafka producer/consumer API this project uses,
+with real partitioning by key, consumer groups with partition assignment and
+committed offsets. Selected with KAFKA_BOOTSTRAP_SERVERS=memory:// so the API
+and service_processor can run in one process without a broker.
+"""
+import asyncio
+import dataclasses
+import itertools
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from aiokafka.errors import CommitFailedError
+from aiokafka.partitioner import DefaultPartitioner
+from aiokafka.structs import ConsumerRecord, RecordMetadata, TopicPartition
+
+class InMemoryBroker:
+    def __init__(self, num_partitions: int = 4):
+        self.num_partitions = num_partitions
+        self.partitioner = DefaultPartitioner()
+        self._logs: Dict[TopicPartition, List[ConsumerRecord]] = defaultdict(list)
+        self._committed: Dict[str, Dict[TopicPartition, int]] = defaultdict(dict)
+        self._members: Dict[str, List["InMemoryConsumer"]] = defaultdict(list)
+
+    def partitions_for(self, topic: str) -> List[TopicPartition]:
+        return [TopicPartition(topic, partition) for partition in range(self.num_partitions)]
+
+    def append(self, topic: str, key: Optional[bytes], value: Optional[bytes], partition: Optional[int] = None):
+        if partition is None:
+            partitions = list(range(self.num_partitions))
+            partition = self.partitioner(key, partitions, partitions)
+        tp = TopicPartition(topic, partition)
+        log = self._logs[tp]
+        timestamp = int(time.time() * 1000)
+        log.append(ConsumerRecord(
+            topic=topic, partition=partition, offset=len(log), timestamp=timestamp,
+            timestamp_type=0, key=key, value=value, checksum=None,
+            serialized_key_size=len(key) if key else -1,
+            serialized_value_size=len(value) if value else -1, headers=(),
+        ))
+        return RecordMetadata(topic, partition, tp, len(log) - 1, timestamp, 0, 0)
+
+    def read(self, tp: TopicPartition, offset: int, limit: int) -> List[ConsumerRecord]:
+        return self._logs[tp][offset:offset + limit]
+
+    def end_offset(self, tp: TopicPartition) -> int:
+        return len(self._logs[tp])
+
+    def committed(self, group_id: str, tp: TopicPartition) -> Optional[int]:
+        return self._committed[group_id].get(tp)
+
+    def commit(self, group_id: str, offsets: Dict[TopicPartition, int]):
+        self._committed[group_id].update(offsets)
+
+    def join(self, consumer: "InMemoryConsumer"):
+        self._members[consumer.group_id].append(consumer)
+        self._rebalance(consumer.group_id)
+
+    def leave(self, consumer: "InMemoryConsumer"):
+        members = self._members[consumer.group_id]
+        if consumer in members:
+            members.remove(consumer)
+            self._rebalance(consumer.group_id)
+
+    def _rebalance(self, group_id: str):
+        members = self._members[group_id]
+        for member in members:
+            member._assign([])
+        if not members:
+            return
+        assignments = defaultdict(list)
+        topics = sorted({topic for member in members for topic in member.topics})
+        partitions = [tp for topic in topics for tp in self.partitions_for(topic)]
+        for tp, member in zip(partitions, itertools.cycle(members)):
+            if tp.topic in member.topics:
+                assignments[id(member)].append(tp)
+        for member in members:
+            member._assign(assignments[id(member)])
+
+class InMemoryProducer:
+    def __init__(self, broker: InMemoryBroker, value_serializer: Optional[Callable] = None,
+                 key_serializer: Optional[Callable] = None, **_):
+        self.broker = broker
+        self.value_serializer = value_serializer or (lambda value: value)
+        self.key_serializer = key_serializer or (lambda key: key)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def send(self, topic: str, value=None, key=None, partition: Optional[int] = None):
+        metadata = self.broker.append(
+            topic,
+            self.key_serializer(key) if key is not None else None,
+            self.value_serializer(value) if value is not None else None,
+            partition,
+        )
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(metadata)
+        return future
+
+    async def send_and_wait(self, topic: str, value=None, key=None, partition: Optional[int] = None):
+        return await (await self.send(topic, value=value, key=key, partition=partition))
+
+class InMemoryConsumer:
+    def __init__(self, *topics: str, broker: InMemoryBroker, group_id: str = "default",
+                 value_deserializer: Optional[Callable] = None, key_deserializer: Optional[Callable] = None,
+                 auto_offset_reset: str = "earliest", max_poll_records: int = 500, **_):
+        self.broker = broker
+        self.topics = set(topics)
+        self.group_id = group_id
+        self.value_deserializer = value_deserializer or (lambda value: value)
+        self.key_deserializer = key_deserializer or (lambda key: key)
+        self.auto_offset_reset = auto_offset_reset
+        self.max_poll_records = max_poll_records
+        self._positions: Dict[TopicPartition, int] = {}
+
+    def _assign(self, partitions: List[TopicPartition]):
+        positions = {}
+        for tp in partitions:
+            committed = self.broker.committed(self.group_id, tp)
+            if committed is None:
+                committed = 0 if self.auto_offset_reset == "earliest" else self.broker.end_offset(tp)
+            positions[tp] = committed
+        self._positions = positions
+
+    async def start(self):
+        self.broker.join(self)
+
+    async def stop(self):
+        self.broker.leave(self)
+
+    def assignment(self):
+        return set(self._positions)
+
+    def highwater(self, tp: TopicPartition) -> Optional[int]:
+        return self.broker.end_offset(tp) if tp in self._positions else None
+
+    async def position(self, tp: TopicPartition) -> int:
+        return self._positions[tp]
+
+    async def commit(self, offsets: Optional[Dict[TopicPartition, int]] = None):
+        if offsets is None:
+            offsets = dict(self._positions)
+        if any(tp not in self._positions for tp in offsets):
+            raise CommitFailedError("Partitions were reassigned to another group member")
+        self.broker.commit(self.group_id, offsets)
+
+    def _deserialize(self, record: ConsumerRecord) -> ConsumerRecord:
+        return dataclasses.replace(
+            record,
+            key=self.key_deserializer(record.key) if record.key is not None else None,
+            value=self.value_deserializer(record.value) if record.value is not None else None,
+        )
+
+    async def getmany(self, *partitions: TopicPartition, timeout_ms: int = 0, max_records: Optional[int] = None):
+        limit = max_records or self.max_poll_records
+        deadline = time.monotonic() + timeout_ms / 1000
+        while True:
+            result = {}
+            for tp in (partitions or list(self._positions)):
+                if limit <= 0:
+                    break
+                records = self.broker.read(tp, self._positions[tp], limit)
+                if records:
+                    self._positions[tp] += len(records)
+                    limit -= len(records)
+                    result[tp] = [self._deserialize(record) for record in records]
+            if result or time.monotonic() >= deadline:
+                return result
+            await asyncio.sleep(0.01)
+
+memory_broker = InMemoryBroker()
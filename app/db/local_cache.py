@@ -0,0 +1,60 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+class LocalCache:
+    """
+    Ограниченный LRU-кэш в памяти процесса с TTL.
+
+    Хранит уже сериализованные значения (bytes), поэтому занимаемая память
+    считается точно, а каждый читатель получает собственную копию объекта.
+
+    Args:
+        max_entries: Максимальное число записей
+        max_bytes: Максимальный суммарный размер ключей и значений
+        ttl: Время жизни записи в секундах
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_bytes = 0
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        self.delete(key)
+        ttl = min(ttl, self.ttl) if ttl else self.ttl
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self.size_bytes += size
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            old_key, (_, old_value) = self._entries.popitem(last=False)
+            self.size_bytes -= len(old_key) + len(old_value)
+
+    def delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= len(key) + len(entry[1])
+
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
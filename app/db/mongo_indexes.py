@@ -0,0 +1,140 @@
+"""Indexes for the services, orders and user_order_stats collections.
+
+Created on startup of the API and the service processor, or by hand:
+
+    python -m db.mongo_indexes            # create missing indexes
+    python -m db.mongo_indexes --check    # create them, then explain every hot query
+
+--check exits with status 1 if the winning plan of any hot query scans the
+whole collection.
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from .mongodb import (
+    ORDERS_SORT, db, orders_collection, services_collection, user_order_stats_collection,
+    _orders_query, _services_query
+)
+
+SERVICE_INDEXES = [
+    IndexModel([("id", ASCENDING)], name="services_id_unique", unique=True),
+]
+ORDER_INDEXES = [
+    IndexModel([("id", ASCENDING)], name="orders_id_unique", unique=True),
+    # Equality on user_id, then the keyset sort of get_orders/iter_orders
+    IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)],
+               name="orders_user_id_created_at_id"),
+    # Orders holding a service, for the projector in db.order_projection
+    IndexModel([("items.id", ASCENDING)], name="orders_items_id"),
+]
+USER_ORDER_STATS_INDEXES = [
+    # One document per user: upserts cannot create duplicates, $merge matches on it
+    IndexModel([("user_id", ASCENDING)], name="user_order_stats_user_id_unique", unique=True),
+]
+
+async def ensure_indexes() -> bool:
+    """Create missing indexes; existing ones with the same spec are left alone."""
+    ok = True
+    for collection, indexes in (
+        (services_collection, SERVICE_INDEXES),
+        (orders_collection, ORDER_INDEXES),
+        (user_order_stats_collection, USER_ORDER_STATS_INDEXES),
+    ):
+        try:
+            names = await collection.create_indexes(indexes)
+            print(f"Indexes on {collection.name}: {', '.join(names)}")
+        except OperationFailure as e:
+            # Typically duplicate ids left from before the unique index existed
+            print(f"Error creating indexes on {collection.name}: {e}")
+            ok = False
+        except PyMongoError as e:
+            print(f"Could not create indexes on {collection.name}: {e}")
+            ok = False
+    return ok
+
+def _sample_key() -> Tuple[datetime, str]:
+    return datetime.utcnow(), "00000000-0000-0000-0000-000000000000"
+
+def hot_queries() -> Dict[str, dict]:
+    """The commands behind db.mongodb's CRUD functions, keyed by function name."""
+    created_at, sample_id = _sample_key()
+    return {
+        "get_service": {"find": services_collection.name, "filter": {"id": sample_id}, "limit": 1},
+        "get_services": {"find": services_collection.name, "filter": _services_query(), "sort": {"id": 1}},
+        "get_services(after)": {
+            "find": services_collection.name, "filter": _services_query(sample_id), "sort": {"id": 1}, "limit": 100,
+        },
+        "get_services_by_ids": {"find": services_collection.name, "filter": {"id": {"$in": [sample_id]}}},
+        "upsert_services": {
+            "update": services_collection.name,
+            "updates": [{"q": {"id": sample_id}, "u": {"id": sample_id}, "upsert": True}],
+        },
+        "get_order": {"find": orders_collection.name, "filter": {"id": sample_id}, "limit": 1},
+        "get_orders": {
+            "find": orders_collection.name, "filter": _orders_query("user"), "sort": dict(ORDERS_SORT),
+        },
+        "get_orders(after)": {
+            "find": orders_collection.name, "filter": _orders_query("user", (created_at, sample_id)),
+            "sort": dict(ORDERS_SORT), "limit": 100,
+        },
+        "project_services": {
+            "update": orders_collection.name,
+            "updates": [{
+                "q": {"items": {"$elemMatch": {"id": sample_id, "name": {"$ne": "name"}}}},
+                "u": {"$set": {"items.$[item].name": "name"}}, "arrayFilters": [{"item.id": sample_id}], "multi": True,
+            }],
+        },
+        "update_order_services": {
+            "findAndModify": orders_collection.name, "query": {"id": sample_id, "user_id": "user"},
+            "update": {"$inc": {"total_price": 0}},
+        },
+        "get_user_order_stats": {"find": user_order_stats_collection.name, "filter": {"user_id": "user"}, "limit": 1},
+        "_count_order": {
+            "update": user_order_stats_collection.name,
+            "updates": [{"q": {"user_id": "user"}, "u": {"$inc": {"order_count": 1}}, "upsert": True}],
+        },
+    }
+
+def _stages(plan: dict) -> List[str]:
+    stages = [plan["stage"]] if "stage" in plan else []
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages.extend(_stages(plan[child_key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_stages(child))
+    return stages
+
+async def explain_hot_queries() -> Dict[str, List[str]]:
+    """Stages of the winning plan of every hot query."""
+    plans = {}
+    for name, command in hot_queries().items():
+        explained = await db.command({"explain": command, "verbosity": "queryPlanner"})
+        plans[name] = _stages(explained["queryPlanner"]["winningPlan"])
+    return plans
+
+async def check_indexes() -> bool:
+    ok = True
+    for name, stages in (await explain_hot_queries()).items():
+        scans = "COLLSCAN" in stages
+        ok = ok and not scans
+        print(f"{'FAIL' if scans else 'ok':4} {name}: {' <- '.join(stages)}")
+    return ok
+
+async def _main(check: bool) -> bool:
+    created = await ensure_indexes()
+    return await check_indexes() and created if check else created
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="fail if a hot query is a collection scan")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(_main(args.check)) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -2,20 +2,26 @@ import os
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime
 import uuid
-from typing import Optional, List
+from typing import Callable, Dict, Optional, List, Tuple
 from pydantic import BaseModel, Field
+from pymongo import ReplaceOne, ReturnDocument
+from .instrumentation import instrumented
 
 # MongoDB connection settings
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 MONGODB_DB = os.getenv("MONGODB_DB", "service_db")
+# Connections the driver keeps open even when idle
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", 10))
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", 100))
 
 # MongoDB client
-client = AsyncIOMotorClient(MONGODB_URI)
+client = AsyncIOMotorClient(MONGODB_URI, minPoolSize=MONGODB_MIN_POOL_SIZE, maxPoolSize=MONGODB_MAX_POOL_SIZE)
 db = client[MONGODB_DB]
 
 # Collections
 services_collection = db.services
 orders_collection = db.orders
+user_order_stats_collection = db.user_order_stats
 
 # MongoDB Models
 class ServiceMongo(BaseModel):
@@ -25,55 +31,238 @@ class ServiceMongo(BaseModel):
     price: float
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
-    class Config:
-        json_encoders = {
-            datetime: lambda dt: dt.isoformat()
-        }
+class OrderItem(BaseModel):
+    # Snapshot of the service when it was ordered; service_processor keeps
+    # the name in line with the catalog, the price stays what was charged
+    id: str
+    name: str
+    price: float
 
 class OrderMongo(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
     services: List[str]  # List of service IDs
+    items: List[OrderItem] = Field(default_factory=list)
     total_price: float
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
-    class Config:
-        json_encoders = {
-            datetime: lambda dt: dt.isoformat()
-        }
+class UserOrderStats(BaseModel):
+    # Running totals over a user's orders, kept by create_order and the
+    # order mutations; db.order_stats rebuilds them from the orders
+    user_id: str
+    order_count: int = 0
+    service_count: int = 0
+    total_spent: float = 0.0
+    updated_at: Optional[datetime] = None
 
 # MongoDB CRUD operations
+@instrumented("mongo")
 async def create_service(service: ServiceMongo):
-    service_dict = service.dict()
+    service_dict = service.model_dump()
     await services_collection.insert_one(service_dict)
     return service
 
-async def get_services():
-    cursor = services_collection.find()
-    services = await cursor.to_list(length=None)
-    return [ServiceMongo(**service) for service in services]
+@instrumented("mongo")
+async def upsert_services(services: List[ServiceMongo]):
+    # Replacing by id makes a redelivered command a no-op instead of a
+    # duplicate; unordered so one bad document does not stop the batch
+    if services:
+        await services_collection.bulk_write(
+            [ReplaceOne({"id": service.id}, service.model_dump(), upsert=True) for service in services],
+            ordered=False
+        )
+    return services
+
+# Keyset pagination: services are ordered by id, orders by (created_at, id).
+# `after` is the sort key of the last row of the previous page.
+STREAM_BATCH_SIZE = 500
+
+def _services_query(after: Optional[str] = None):
+    return {"id": {"$gt": after}} if after is not None else {}
+
+# Documents as stored, without _id; the API serializes these directly
+# instead of building a ServiceMongo/OrderMongo for every row first
+DOCUMENT_PROJECTION = {"_id": 0}
+
+@instrumented("mongo")
+async def find_service_documents(after: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+    cursor = services_collection.find(_services_query(after), DOCUMENT_PROJECTION).sort("id", 1)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return await cursor.to_list(length=None)
 
+async def get_services(after: Optional[str] = None, limit: Optional[int] = None):
+    return [ServiceMongo(**service) for service in await find_service_documents(after, limit)]
+
+async def iter_services(after: Optional[str] = None):
+    cursor = services_collection.find(_services_query(after)).sort("id", 1).batch_size(STREAM_BATCH_SIZE)
+    async for service in cursor:
+        yield ServiceMongo(**service)
+
+@instrumented("mongo")
 async def get_service(service_id: str):
     service = await services_collection.find_one({"id": service_id})
     return ServiceMongo(**service) if service else None
 
+@instrumented("mongo")
+async def get_services_by_ids(service_ids: List[str]):
+    # One $in query for the whole basket instead of a find_one per id.
+    # Returns the found services keyed by id and the ids that do not exist,
+    # in the order they first appear in service_ids.
+    unique_ids = list(dict.fromkeys(service_ids))
+    if not unique_ids:
+        return {}, []
+    cursor = services_collection.find({"id": {"$in": unique_ids}})
+    services = {}
+    async for service in cursor:
+        services[service["id"]] = ServiceMongo(**service)
+    missing = [service_id for service_id in unique_ids if service_id not in services]
+    return services, missing
+
+@instrumented("mongo")
 async def create_order(order: OrderMongo):
-    order_dict = order.dict()
+    order_dict = order.model_dump()
     await orders_collection.insert_one(order_dict)
+    await _count_order(order.user_id, 1, len(order.services), order.total_price)
     return order
 
-async def get_orders(user_id: str):
-    cursor = orders_collection.find({"user_id": user_id})
-    orders = await cursor.to_list(length=None)
-    return [OrderMongo(**order) for order in orders]
+async def _count_order(user_id: str, orders: int, services: int, spent: float):
+    # A single $inc per write instead of re-reading the user's orders. The
+    # order and its stats are two writes: if the second one is lost the
+    # stats drift until `python -m db.order_stats` rebuilds them.
+    if not (orders or services or spent):
+        return
+    await user_order_stats_collection.update_one(
+        {"user_id": user_id},
+        {
+            "$inc": {"order_count": orders, "service_count": services, "total_spent": spent},
+            "$set": {"updated_at": datetime.utcnow()},
+        },
+        upsert=True,
+    )
+
+@instrumented("mongo")
+async def get_user_order_stats(user_id: str) -> UserOrderStats:
+    stats = await user_order_stats_collection.find_one({"user_id": user_id}, DOCUMENT_PROJECTION)
+    return UserOrderStats(**stats) if stats else UserOrderStats(user_id=user_id)
+
+ORDERS_SORT = [("created_at", 1), ("id", 1)]
 
+def _orders_query(user_id: str, after: Optional[Tuple[datetime, str]] = None):
+    query = {"user_id": user_id}
+    if after is not None:
+        created_at, order_id = after
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": order_id}},
+        ]
+    return query
+
+@instrumented("mongo")
+async def find_order_documents(
+    user_id: str, after: Optional[Tuple[datetime, str]] = None, limit: Optional[int] = None
+) -> List[dict]:
+    cursor = orders_collection.find(_orders_query(user_id, after), DOCUMENT_PROJECTION).sort(ORDERS_SORT)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return await cursor.to_list(length=None)
+
+async def get_orders(user_id: str, after: Optional[Tuple[datetime, str]] = None, limit: Optional[int] = None):
+    return [OrderMongo(**order) for order in await find_order_documents(user_id, after, limit)]
+
+async def iter_orders(user_id: str, after: Optional[Tuple[datetime, str]] = None):
+    cursor = orders_collection.find(_orders_query(user_id, after)).sort(ORDERS_SORT).batch_size(STREAM_BATCH_SIZE)
+    async for order in cursor:
+        yield OrderMongo(**order)
+
+@instrumented("mongo")
 async def get_order(order_id: str):
     order = await orders_collection.find_one({"id": order_id})
     return OrderMongo(**order) if order else None
 
-async def update_order_services(order_id: str, service_ids: List[str], total_price: float):
-    await orders_collection.update_one(
-        {"id": order_id},
-        {"$set": {"services": service_ids, "total_price": total_price}}
+async def _mutate_order(order_id: str, user_id: str, update, apply: Callable[[dict], dict]):
+    # Ownership check and write in one atomic round trip; None when the order
+    # does not exist or belongs to someone else. The order is returned as it
+    # was before the write, so the stats get the exact delta even when
+    # requests race on the same order; `apply` then does the same change to
+    # it here instead of a second read.
+    before = await orders_collection.find_one_and_update(
+        {"id": order_id, "user_id": user_id}, update, return_document=ReturnDocument.BEFORE
+    )
+    if before is None:
+        return None
+    after = apply(before)
+    await _count_order(
+        user_id, 0, len(after["services"]) - len(before["services"]), after["total_price"] - before["total_price"]
     )
-    return await get_order(order_id) 
\ No newline at end of file
+    return OrderMongo(**after)
+
+def _total(items: List[OrderItem]) -> float:
+    return sum(item.price for item in items)
+
+@instrumented("mongo")
+async def update_order_services(order_id: str, user_id: str, items: List[OrderItem]):
+    changes = {
+        "services": [item.id for item in items],
+        "items": [item.model_dump() for item in items],
+        "total_price": _total(items),
+    }
+    return await _mutate_order(order_id, user_id, {"$set": changes}, lambda order: {**order, **changes})
+
+@instrumented("mongo")
+async def add_order_services(order_id: str, user_id: str, items: List[OrderItem]):
+    # Orders without items (see db.order_projection) stay without them:
+    # items for the new services only would make remove mode give back the
+    # wrong amount. Callers backfill the order first where they can.
+    service_ids = [item.id for item in items]
+    snapshots = [item.model_dump() for item in items]
+    return await _mutate_order(order_id, user_id, [{"$set": {
+        "services": {"$concatArrays": ["$services", {"$literal": service_ids}]},
+        "items": {"$cond": [
+            {"$isArray": "$items"}, {"$concatArrays": ["$items", {"$literal": snapshots}]}, "$$REMOVE",
+        ]},
+        "total_price": {"$add": ["$total_price", _total(items)]},
+    }}], lambda order: _apply_addition(order, service_ids, snapshots, _total(items)))
+
+def _apply_addition(order: dict, service_ids: List[str], snapshots: List[dict], total: float) -> dict:
+    # The pipeline above, applied to the order as it was before the write
+    items = {"items": order["items"] + snapshots} if isinstance(order.get("items"), list) else {}
+    return {**order, **items, "services": order["services"] + service_ids, "total_price": order["total_price"] + total}
+
+def _without(field: str, service_ids: List[str], path: str = "$$this"):
+    return {"$filter": {"input": field, "cond": {"$not": [{"$in": [path, service_ids]}]}}}
+
+@instrumented("mongo")
+async def remove_order_services(order_id: str, user_id: str, prices: Dict[str, float]):
+    # Every occurrence of the given ids is removed. How many there were is
+    # only known server side, so the total is reduced in the same pipeline
+    # update instead of a $pull with a precomputed $inc. Orders with item
+    # snapshots give back what was charged; older ones the catalog price.
+    service_ids = list(prices)
+    removed_snapshots = {"$sum": {"$map": {
+        "input": {"$filter": {"input": "$items", "cond": {"$in": ["$$this.id", service_ids]}}},
+        "in": "$$this.price",
+    }}}
+    removed_catalog = {"$sum": [
+        {"$multiply": [price, {"$size": {"$filter": {"input": "$services", "cond": {"$eq": ["$$this", service_id]}}}}]}
+        for service_id, price in prices.items()
+    ]}
+    return await _mutate_order(order_id, user_id, [{"$set": {
+        "services": _without("$services", service_ids),
+        "items": {"$cond": [{"$isArray": "$items"}, _without("$items", service_ids, "$$this.id"), "$$REMOVE"]},
+        "total_price": {"$subtract": [
+            "$total_price", {"$cond": [{"$isArray": "$items"}, removed_snapshots, removed_catalog]},
+        ]},
+    }}], lambda order: _apply_removal(order, prices))
+
+def _apply_removal(order: dict, prices: Dict[str, float]) -> dict:
+    # The pipeline above, applied to the order as it was before the write
+    kept = [service_id for service_id in order["services"] if service_id not in prices]
+    if isinstance(order.get("items"), list):
+        removed = sum(item["price"] for item in order["items"] if item["id"] in prices)
+        items = {"items": [item for item in order["items"] if item["id"] not in prices]}
+    else:
+        removed = sum(price * order["services"].count(service_id) for service_id, price in prices.items())
+        items = {}
+    order = {key: value for key, value in order.items() if key != "items"}
+    return {**order, **items, "services": kept, "total_price": order["total_price"] - removed}
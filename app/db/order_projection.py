@@ -0,0 +1,100 @@
+"""Service snapshots embedded in orders.
+
+Every order carries an item (id, name, price) per service, so reading an
+order needs no catalog lookups. The API writes the items together with the
+order; service_processor applies catalog changes to them here.
+
+Orders written before items existed get them from the current catalog, but
+only while its prices still add up to what the order was charged: remove
+mode gives back item prices, so items at a changed price would skew the
+total. Those orders keep no items and are handled at catalog prices.
+"""
+from typing import Dict, List, Optional
+
+from pymongo import UpdateMany, UpdateOne
+
+from .instrumentation import instrumented
+from .mongodb import OrderItem, ServiceMongo, get_services_by_ids, orders_collection
+
+BACKFILL_BATCH_SIZE = 500
+BACKFILL_PROJECTION = {"_id": 0, "id": 1, "services": 1, "total_price": 1}
+# Rounding allowed between the catalog prices and the charged total
+PRICE_TOLERANCE = 0.005
+
+def order_items(service_ids: List[str], services: Dict[str, ServiceMongo]) -> List[OrderItem]:
+    return [
+        OrderItem(id=service.id, name=service.name, price=service.price)
+        for service in (services[service_id] for service_id in service_ids)
+    ]
+
+@instrumented("mongo")
+async def project_services(services: List[ServiceMongo]) -> int:
+    """Rename the items of changed services in every order that has them.
+
+    Prices are not touched: an item keeps the price the order was charged.
+    Orders whose items already carry the name are not matched, so replaying
+    a batch writes nothing.
+    """
+    # New services are in no order yet: one indexed lookup instead of a write per service
+    ordered_ids = set(await orders_collection.distinct(
+        "items.id", {"items.id": {"$in": [service.id for service in services]}}
+    ))
+    services = [service for service in services if service.id in ordered_ids]
+    if not services:
+        return 0
+    result = await orders_collection.bulk_write([
+        UpdateMany(
+            {"items": {"$elemMatch": {"id": service.id, "name": {"$ne": service.name}}}},
+            {"$set": {"items.$[item].name": service.name}},
+            array_filters=[{"item.id": service.id}],
+        )
+        for service in services
+    ], ordered=False)
+    return result.modified_count
+
+def backfilled_items(order: dict, services: Dict[str, ServiceMongo]) -> Optional[List[OrderItem]]:
+    """Items for an order without them; None if the catalog no longer matches what it was charged."""
+    if any(service_id not in services for service_id in order["services"]):
+        return None
+    items = order_items(order["services"], services)
+    if abs(sum(item.price for item in items) - order["total_price"]) > PRICE_TOLERANCE:
+        return None
+    return items
+
+async def _backfill(orders: List[dict]) -> int:
+    services, missing = await get_services_by_ids(
+        [service_id for order in orders for service_id in order["services"]]
+    )
+    if missing:
+        print(f"Services {missing} no longer exist, their orders keep no items")
+    updates = []
+    for order in orders:
+        items = backfilled_items(order, services)
+        if items is not None:
+            updates.append(UpdateOne(
+                {"id": order["id"], "items": {"$exists": False}},
+                {"$set": {"items": [item.model_dump() for item in items]}},
+            ))
+        elif all(service_id in services for service_id in order["services"]):
+            print(f"Order {order['id']} was charged {order['total_price']}, not the current prices: it keeps no items")
+    if not updates:
+        return 0
+    return (await orders_collection.bulk_write(updates, ordered=False)).modified_count
+
+async def backfill_order_items(batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Add items to orders written before they existed, priced from the current catalog."""
+    filled = 0
+    cursor = orders_collection.find({"items": {"$exists": False}}, BACKFILL_PROJECTION)
+    while True:
+        orders = await cursor.to_list(length=batch_size)
+        if not orders:
+            return filled
+        filled += await _backfill(orders)
+
+@instrumented("mongo")
+async def backfill_order(order_id: str, user_id: str) -> bool:
+    """Add items to one of the user's orders if it has none yet; True if it got them."""
+    order = await orders_collection.find_one(
+        {"id": order_id, "user_id": user_id, "items": {"$exists": False}}, BACKFILL_PROJECTION
+    )
+    return order is not None and await _backfill([order]) > 0
@@ -0,0 +1,66 @@
+"""Rebuild of the per-user order statistics from the orders themselves.
+
+The API keeps user_order_stats up to date with an $inc per order write
+(db.mongodb). A write lost between an order and its stats, or a change made
+to orders by hand, leaves them off; this recomputes them with one
+aggregation per run:
+
+    python -m db.order_stats                  # every user
+    python -m db.order_stats --user alice     # one user
+
+Stats of users left without orders are deleted. Orders written while it
+runs may be counted twice or not at all for their user, so run it when the
+API is quiet or rerun it for the affected users.
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from typing import List, Optional
+
+from .mongo_indexes import ensure_indexes
+from .mongodb import orders_collection, user_order_stats_collection
+
+def rebuild_pipeline(run_started: datetime, user_id: Optional[str] = None) -> List[dict]:
+    match = [{"$match": {"user_id": user_id}}] if user_id is not None else []
+    return match + [
+        {"$group": {
+            "_id": "$user_id",
+            "order_count": {"$sum": 1},
+            "service_count": {"$sum": {"$size": "$services"}},
+            "total_spent": {"$sum": "$total_price"},
+        }},
+        {"$project": {
+            "_id": 0, "user_id": "$_id", "order_count": 1, "service_count": 1, "total_spent": 1,
+            # The app's clock, like the $inc updates in db.mongodb
+            "updated_at": {"$literal": run_started},
+        }},
+        # Needs the unique index on user_id that ensure_indexes creates
+        {"$merge": {
+            "into": user_order_stats_collection.name, "on": "user_id",
+            "whenMatched": "replace", "whenNotMatched": "insert",
+        }},
+    ]
+
+async def rebuild_order_stats(user_id: Optional[str] = None) -> int:
+    """Recompute the stats of one or every user; returns how many users have stats."""
+    # Mongo keeps milliseconds: truncated, the rebuilt documents are not older than the run
+    now = datetime.utcnow()
+    run_started = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    await orders_collection.aggregate(rebuild_pipeline(run_started, user_id)).to_list(length=None)
+    query = {"user_id": user_id} if user_id is not None else {}
+    # Neither rebuilt nor counted since: the user no longer has any orders
+    await user_order_stats_collection.delete_many({**query, "updated_at": {"$not": {"$gte": run_started}}})
+    return await user_order_stats_collection.count_documents(query)
+
+async def _main(user_id: Optional[str]) -> int:
+    await ensure_indexes()
+    return await rebuild_order_stats(user_id)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", help="rebuild only this user's stats")
+    args = parser.parse_args()
+    print(f"Rebuilt order stats of {asyncio.run(_main(args.user))} users")
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,183 @@
 import os
 import json
-from typing import Any, Optional
-import redis
+import time
+from typing import Any, Dict, List, Optional
+import redis.asyncio as redis
 from redis.exceptions import RedisError
+from .instrumentation import instrumented
+
+# Сравнение и удаление одной операцией: блокировка, истёкшая и захваченная
+# другим процессом, не будет снята по ошибке
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
 
 class RedisClient:
     def __init__(self):
         self.redis_host = os.getenv("REDIS_HOST", "localhost")
         self.redis_port = int(os.getenv("REDIS_PORT", 6379))
-        self.client = redis.Redis(
+        # Общий ограниченный пул: при исчерпании запросы ждут освобождения
+        # соединения не дольше pool_timeout, а не открывают новые
+        self.pool = redis.BlockingConnectionPool(
+            host=self.redis_host,
+            port=self.redis_port,
+            max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 50)),
+            timeout=float(os.getenv("REDIS_POOL_TIMEOUT", 5)),
+            socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", 2)),
+            socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", 2)),
+            health_check_interval=30,
+        )
+        self.client = redis.Redis(connection_pool=self.pool)
+        # Подписке на канал нужно своё соединение без socket_timeout: канал
+        # может молчать сколько угодно, и это не ошибка. Обрыв соединения
+        # подписчик обнаруживает сам, по ответу на PING
+        self.pubsub_client = redis.Redis(
             host=self.redis_host,
             port=self.redis_port,
-            decode_responses=True
+            socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", 2)),
+            socket_keepalive=True,
         )
         self.default_ttl = 3600  # 1 час по умолчанию
 
-    def get(self, key: str) -> Optional[Any]:
+    @instrumented("redis")
+    async def get(self, key: str) -> Optional[Any]:
         """Получение данных из кэша"""
         try:
-            data = self.client.get(key)
+            data = await self.client.get(key)
             return json.loads(data) if data else None
         except (RedisError, json.JSONDecodeError):
             return None
 
-    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+    @instrumented("redis")
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         """Сохранение данных в кэш"""
         try:
             ttl = ttl or self.default_ttl
-            return self.client.setex(
+            return bool(await self.client.setex(
                 key,
                 ttl,
                 json.dumps(value)
-            )
+            ))
         except (RedisError, TypeError):
             return False
 
-    def delete(self, key: str) -> bool:
+    @instrumented("redis")
+    async def get_bytes(self, key: str) -> Optional[bytes]:
+        """Получение сырых (уже сериализованных кодеком) данных из кэша"""
+        try:
+            return await self.client.get(key)
+        except RedisError:
+            return None
+
+    @instrumented("redis")
+    async def set_bytes(self, key: str, value: bytes, ttl: Optional[int] = None) -> bool:
+        """Сохранение сырых (уже сериализованных кодеком) данных в кэш"""
+        try:
+            return bool(await self.client.setex(key, ttl or self.default_ttl, value))
+        except RedisError:
+            return False
+
+    @instrumented("redis")
+    async def mget_bytes(self, keys: List[str]) -> List[Optional[bytes]]:
+        """Получение нескольких значений за один запрос"""
+        if not keys:
+            return []
+        try:
+            return await self.client.mget(keys)
+        except RedisError:
+            return [None] * len(keys)
+
+    @instrumented("redis")
+    async def mset_bytes(self, mapping: Dict[str, bytes], ttl: Optional[int] = None) -> bool:
+        """Сохранение нескольких значений с TTL за один запрос (pipeline)"""
+        if not mapping:
+            return True
+        try:
+            ttl = ttl or self.default_ttl
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key, value in mapping.items():
+                    pipe.setex(key, ttl, value)
+                await pipe.execute()
+            return True
+        except RedisError:
+            return False
+
+    @instrumented("redis")
+    async def incr_many(self, keys: List[str]) -> bool:
+        """Атомарный инкремент нескольких счётчиков за один запрос"""
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.incr(key)
+                await pipe.execute()
+            return True
+        except RedisError:
+            return False
+
+    @instrumented("redis")
+    async def delete(self, *keys: str) -> bool:
         """Удаление данных из кэша"""
         try:
-            return bool(self.client.delete(key))
+            return bool(await self.client.delete(*keys))
         except RedisError:
             return False
 
-    def exists(self, key: str) -> bool:
+    @instrumented("redis")
+    async def exists(self, key: str) -> bool:
         """Проверка существования ключа в кэше"""
         try:
-            return bool(self.client.exists(key))
+            return bool(await self.client.exists(key))
+        except RedisError:
+            return False
+
+    @instrumented("redis")
+    async def acquire_lock(self, key: str, token: str, ttl_ms: int) -> Optional[bool]:
+        """
+        Захват блокировки (SET NX PX); истекает сама, если владелец упал.
+
+        False - блокировку держит другой процесс, None - Redis недоступен
+        """
+        try:
+            return bool(await self.client.set(key, token, nx=True, px=ttl_ms))
+        except RedisError:
+            return None
+
+    @instrumented("redis")
+    async def release_lock(self, key: str, token: str) -> bool:
+        """Снятие блокировки, только если она всё ещё принадлежит token"""
+        try:
+            return bool(await self.client.eval(_RELEASE_LOCK_SCRIPT, 1, key, token))
+        except RedisError:
+            return False
+
+    @instrumented("redis")
+    async def remember(self, key: str, member: str, limit: int) -> bool:
+        """Отметка member как последнего использованного; в наборе остаются limit самых свежих"""
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.zadd(key, {member: time.time()})
+                pipe.zremrangebyrank(key, 0, -limit - 1)
+                await pipe.execute()
+            return True
         except RedisError:
             return False
 
+    @instrumented("redis")
+    async def most_recent(self, key: str, count: int) -> List[str]:
+        """count последних отмеченных через remember, от самого свежего"""
+        try:
+            return [member.decode() for member in await self.client.zrevrange(key, 0, count - 1)]
+        except RedisError:
+            return []
+
+    async def close(self):
+        """Закрытие всех соединений пула"""
+        await self.client.aclose()
+        await self.pool.aclose()
+        await self.pubsub_client.aclose()
+
 # Создаем глобальный экземпляр клиента
-redis_client = RedisClient() 
\ No newline at end of file
+redis_client = RedisClient()
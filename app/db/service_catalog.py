@@ -0,0 +1,89 @@
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .cache_invalidation import namespace_key
+from .mongodb import ServiceMongo, get_services_by_ids
+from .tiered_cache import tiered_cache
+
+SERVICE_CATALOG_TTL = float(os.getenv("SERVICE_CATALOG_TTL", 300))
+SERVICE_CATALOG_MAX_SIZE = int(os.getenv("SERVICE_CATALOG_MAX_SIZE", 50000))
+
+class ServiceCatalog:
+    """In-process catalog of services used to price orders.
+
+    service_processor bumps the "services" cache namespace after every batch
+    of new or changed services; the bump reaches every worker over the cache
+    pub/sub channel and empties this catalog, so orders are not priced or
+    named from a service as it was before. While that channel is down the
+    catalog is bypassed. Unknown ids are never cached: a service created a
+    moment ago is looked up in MongoDB instead of being reported missing.
+    """
+
+    def __init__(self, ttl: float = SERVICE_CATALOG_TTL, max_size: int = SERVICE_CATALOG_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: Dict[str, Tuple[float, ServiceMongo]] = {}
+        # Bumped by every invalidation; a lookup that started before one does not store its result
+        self.generation = 0
+        tiered_cache.on_invalidate(self._on_cache_invalidate)
+
+    def get(self, service_id: str) -> Optional[ServiceMongo]:
+        if not tiered_cache.listening:
+            return None
+        entry = self._entries.get(service_id)
+        if entry is None:
+            return None
+        expires_at, service = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(service_id, None)
+            return None
+        return service
+
+    def put(self, service: ServiceMongo):
+        if not tiered_cache.listening:
+            return
+        self._entries.pop(service.id, None)
+        self._entries[service.id] = (time.monotonic() + self.ttl, service)
+        # dicts keep insertion order, so the first key is the oldest entry
+        while len(self._entries) > self.max_size:
+            self._entries.pop(next(iter(self._entries)))
+
+    def invalidate(self, service_id: Optional[str] = None):
+        self.generation += 1
+        if service_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(service_id, None)
+
+    async def get_many(self, service_ids: List[str]):
+        """Resolve service ids, going to MongoDB only for the ids not held locally.
+
+        Returns a dict of found services keyed by id and the list of ids that
+        do not exist, in order of first appearance.
+        """
+        found: Dict[str, ServiceMongo] = {}
+        to_fetch: List[str] = []
+        for service_id in dict.fromkeys(service_ids):
+            service = self.get(service_id)
+            if service is None:
+                to_fetch.append(service_id)
+            else:
+                found[service_id] = service
+
+        if not to_fetch:
+            return found, []
+
+        generation = self.generation
+        fetched, missing = await get_services_by_ids(to_fetch)
+        if generation == self.generation:
+            for service in fetched.values():
+                self.put(service)
+        found.update(fetched)
+        return found, missing
+
+    def _on_cache_invalidate(self, key: Optional[str]):
+        if key is None or key == namespace_key("services"):
+            self.invalidate()
+
+service_catalog = ServiceCatalog()
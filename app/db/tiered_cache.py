@@ -0,0 +1,230 @@
+import asyncio
+import os
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from redis.exceptions import RedisError
+
+from .local_cache import LocalCache
+from .redis_client import redis_client
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+# Как долго канал может молчать, прежде чем подписчик проверит соединение PING
+INVALIDATION_PING_INTERVAL = float(os.getenv("CACHE_INVALIDATION_PING_INTERVAL", 5))
+
+L1_DEFAULT_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", 1024))
+L1_DEFAULT_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", 8 * 1024 * 1024))
+L1_DEFAULT_TTL = float(os.getenv("CACHE_L1_TTL", 30))
+
+def key_prefix(key: str) -> str:
+    return key.partition(":")[0]
+
+class TieredCache:
+    """
+    Двухуровневый кэш: L1 в памяти процесса перед L2 в Redis.
+
+    L1 разбит на секции по префиксу ключа (часть до первого ':'), у каждой
+    секции свои ограничения по числу записей, памяти и TTL. Согласованность
+    между воркерами обеспечивается через Redis pub/sub: изменение ключа
+    публикуется в канал, и остальные процессы удаляют его из своего L1.
+    Пока подписка не активна (не запущена или оборвалась), L1 не используется,
+    чтобы не отдавать значения, об изменении которых процесс мог не узнать.
+    """
+
+    def __init__(self):
+        self.instance_id = uuid.uuid4().hex
+        self._sections: Dict[str, LocalCache] = {}
+        self._section_config: Dict[str, dict] = {}
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"l1_hits": 0, "l1_misses": 0, "l2_hits": 0, "l2_misses": 0}
+        )
+        self._listener: Optional[asyncio.Task] = None
+        self._invalidation_callbacks: List[Callable[[Optional[str]], None]] = []
+        self.listening = False
+
+    def on_invalidate(self, callback: Callable[[Optional[str]], None]):
+        """
+        Подписка на инвалидацию ключей в этом процессе.
+
+        callback вызывается с ключом, удалённым из L1 (локально или по
+        сообщению другого воркера), либо с None, когда L1 очищен целиком.
+        Позволяет держать производные от кэша данные согласованными с ним.
+        """
+        self._invalidation_callbacks.append(callback)
+
+    def _evict_local(self, key: str):
+        self.local(key_prefix(key)).delete(key)
+        for callback in self._invalidation_callbacks:
+            callback(key)
+
+    def configure(self, prefix: str, max_entries: int = L1_DEFAULT_MAX_ENTRIES,
+                  max_bytes: int = L1_DEFAULT_MAX_BYTES, ttl: float = L1_DEFAULT_TTL):
+        """Настройка размера L1 для префикса; ttl=0 отключает L1 для него"""
+        self._section_config[prefix] = {"max_entries": max_entries, "max_bytes": max_bytes, "ttl": ttl}
+        self._sections.pop(prefix, None)
+
+    def local(self, prefix: str) -> LocalCache:
+        section = self._sections.get(prefix)
+        if section is None:
+            config = self._section_config.get(prefix, {})
+            section = LocalCache(
+                max_entries=config.get("max_entries", L1_DEFAULT_MAX_ENTRIES),
+                max_bytes=config.get("max_bytes", L1_DEFAULT_MAX_BYTES),
+                ttl=config.get("ttl", L1_DEFAULT_TTL),
+            )
+            self._sections[prefix] = section
+        return section
+
+    async def get(self, key: str) -> Optional[bytes]:
+        prefix = key_prefix(key)
+        stats = self._stats[prefix]
+        if self.listening:
+            value = self.local(prefix).get(key)
+            if value is not None:
+                stats["l1_hits"] += 1
+                return value
+            stats["l1_misses"] += 1
+
+        value = await redis_client.get_bytes(key)
+        if value is None:
+            stats["l2_misses"] += 1
+            return None
+        stats["l2_hits"] += 1
+        if self.listening:
+            self.local(prefix).set(key, value)
+        return value
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        values: List[Optional[bytes]] = [None] * len(keys)
+        missing = []
+        for index, key in enumerate(keys):
+            stats = self._stats[key_prefix(key)]
+            if self.listening:
+                values[index] = self.local(key_prefix(key)).get(key)
+                if values[index] is not None:
+                    stats["l1_hits"] += 1
+                    continue
+                stats["l1_misses"] += 1
+            missing.append(index)
+
+        if missing:
+            fetched = await redis_client.mget_bytes([keys[index] for index in missing])
+            for index, value in zip(missing, fetched):
+                key = keys[index]
+                stats = self._stats[key_prefix(key)]
+                if value is None:
+                    stats["l2_misses"] += 1
+                    continue
+                stats["l2_hits"] += 1
+                values[index] = value
+                if self.listening:
+                    self.local(key_prefix(key)).set(key, value)
+        return values
+
+    async def set(self, key: str, value: bytes, ttl: Optional[int] = None, broadcast: bool = False) -> bool:
+        """
+        Запись в оба уровня.
+
+        Args:
+            broadcast: Сообщить остальным воркерам, что значение ключа
+                изменилось (нужно, если по ключу могло лежать другое значение)
+        """
+        stored = await redis_client.set_bytes(key, value, ttl)
+        if broadcast:
+            await self.invalidate(key)
+        if self.listening:
+            self.local(key_prefix(key)).set(key, value, ttl)
+        return stored
+
+    async def invalidate(self, *keys: str):
+        """Удаление ключей из L1 этого и всех остальных процессов"""
+        for key in keys:
+            self._evict_local(key)
+        try:
+            async with redis_client.client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.publish(INVALIDATION_CHANNEL, f"{self.instance_id}|{key}")
+                await pipe.execute()
+        except RedisError:
+            pass
+
+    def clear_local(self):
+        for section in self._sections.values():
+            section.clear()
+        for callback in self._invalidation_callbacks:
+            callback(None)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Счётчики попаданий и промахов по уровням для каждого префикса"""
+        result = {}
+        for prefix, counters in self._stats.items():
+            section = self._sections.get(prefix)
+            result[prefix] = dict(
+                counters,
+                l1_entries=len(section) if section else 0,
+                l1_bytes=section.size_bytes if section else 0,
+            )
+        return result
+
+    async def _receive(self, pubsub):
+        awaiting_pong = False
+        while True:
+            message = await pubsub.get_message(timeout=INVALIDATION_PING_INTERVAL)
+            if message is None:
+                # Тишина в канале - обычное дело, а вот молчание в ответ
+                # на PING означает, что соединение оборвано
+                if awaiting_pong:
+                    raise ConnectionError("No reply to PING on the invalidation channel")
+                await pubsub.ping()
+                awaiting_pong = True
+                continue
+            awaiting_pong = False
+            if message["type"] != "message":
+                continue
+            origin, _, key = message["data"].decode().partition("|")
+            if origin != self.instance_id:
+                self._evict_local(key)
+
+    async def _listen(self):
+        while True:
+            pubsub = redis_client.pubsub_client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Всё, что изменилось пока подписки не было, могло быть пропущено
+                self.clear_local()
+                self.listening = True
+                await self._receive(pubsub)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.listening = False
+                self.clear_local()
+                await asyncio.sleep(1)
+            finally:
+                self.listening = False
+                await pubsub.aclose()
+
+    def start(self):
+        """Запуск подписки на инвалидацию (в работающем event loop)"""
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def wait_listening(self, timeout: float) -> bool:
+        """Ожидание активной подписки, без неё L1 не заполняется"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not self.listening and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.05)
+        return self.listening
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        self.clear_local()
+
+tiered_cache = TieredCache()
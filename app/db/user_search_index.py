@@ -0,0 +1,154 @@
+import heapq
+import re
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from sqlalchemy import select
+
+from .models import User
+from .tiered_cache import tiered_cache
+
+_WORD_RE = re.compile(r"\w+")
+SHORTLIST_FACTOR = 4
+
+class IndexedUser(NamedTuple):
+    username: str
+    full_name: Optional[str]
+    disabled: Optional[bool]
+
+def substring_trigrams(text: str) -> Set[str]:
+    """Trigrams of the text itself; every one of them occurs in any string containing it."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def word_trigrams(text: str) -> Set[str]:
+    """Trigrams the way pg_trgm builds them: per word, padded with blanks."""
+    grams = set()
+    for word in _WORD_RE.findall(text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def similarity(left: Set[str], right: Set[str]) -> float:
+    if not left or not right:
+        return 0.0
+    shared = len(left & right)
+    return shared / (len(left) + len(right) - shared)
+
+class UserSearchIndex:
+    """In-process trigram index over users.full_name.
+
+    Meant for small deployments, where keeping every user in memory is
+    cheaper than a database round trip. Posting lists are compact uint32
+    arrays; a query scans only the list of its rarest trigram and checks the
+    substring on those candidates, then ranks matches like pg_trgm's
+    similarity() (exactly among the shortest names, see search()). Masks shorter than three characters have no trigrams and
+    fall back to a linear scan.
+
+    refresh() picks up new users by created_at. Users changed in place
+    (user_admin) are re-read by refresh_changed() once their cached record
+    is invalidated, and everything is re-read after this process may have
+    missed invalidations.
+    """
+
+    def __init__(self):
+        self._users: List[IndexedUser] = []
+        self._names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._postings: Dict[str, array] = {}
+        self.watermark: Optional[datetime] = None
+        self._changed: Set[str] = set()
+        tiered_cache.on_invalidate(self._on_cache_invalidate)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def add(self, username: str, full_name: Optional[str], disabled: Optional[bool] = None):
+        name = (full_name or "").lower()
+        user_id = self._ids.get(username)
+        if user_id is None:
+            user_id = len(self._users)
+            self._ids[username] = user_id
+            self._users.append(IndexedUser(username, full_name, disabled))
+            self._names.append(name)
+        else:
+            # Postings of the old name stay behind; the substring check drops them
+            self._users[user_id] = IndexedUser(username, full_name, disabled)
+            self._names[user_id] = name
+        for gram in substring_trigrams(name):
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array("I")
+            if not postings or postings[-1] != user_id:
+                postings.append(user_id)
+
+    def add_many(self, users: Iterable):
+        for user in users:
+            self.add(user.username, user.full_name, user.disabled)
+
+    async def refresh(self, db):
+        """Load users created since the last refresh (all of them the first time)."""
+        await self.refresh_changed(db)
+        query = select(User.username, User.full_name, User.disabled, User.created_at).order_by(User.created_at)
+        if self.watermark is not None:
+            # >= so rows sharing the watermark timestamp are not missed; add() is idempotent
+            query = query.where(User.created_at >= self.watermark)
+        result = await db.stream(query)
+        async for row in result:
+            self.add(row.username, row.full_name, row.disabled)
+            if row.created_at is not None:
+                self.watermark = row.created_at
+
+    async def refresh_changed(self, db):
+        """Re-read the users whose cached record was invalidated; a no-op if there are none."""
+        if not self._changed:
+            return
+        changed, self._changed = self._changed, set()
+        try:
+            result = await db.execute(
+                select(User.username, User.full_name, User.disabled).where(User.username.in_(changed))
+            )
+        except BaseException:
+            self._changed |= changed
+            raise
+        for row in result:
+            self.add(row.username, row.full_name, row.disabled)
+
+    def _on_cache_invalidate(self, key: Optional[str]):
+        if key is None:
+            # Changes may have been missed: the next refresh reads every user again
+            self.watermark = None
+        elif key.startswith("user:"):
+            self._changed.add(key[len("user:"):])
+
+    def _candidates(self, mask: str) -> Iterable[int]:
+        grams = substring_trigrams(mask)
+        if not grams:
+            return range(len(self._users))
+        postings = [self._postings.get(gram) for gram in grams]
+        if any(posting is None for posting in postings):
+            return ()
+        return min(postings, key=len)
+
+    def search(self, name_mask: str, limit: int) -> List[IndexedUser]:
+        mask = name_mask.lower()
+        matches = dict.fromkeys(
+            user_id for user_id in self._candidates(mask) if mask in self._names[user_id]
+        )
+        # Every match contains the mask, so similarity falls as the name
+        # grows: shortlist the shortest names cheaply, rank only those exactly
+        shortlist = matches
+        if len(matches) > limit * SHORTLIST_FACTOR:
+            shortlist = heapq.nsmallest(
+                limit * SHORTLIST_FACTOR, matches,
+                key=lambda user_id: (len(self._names[user_id]), self._users[user_id].username),
+            )
+        mask_grams = word_trigrams(mask)
+        ranked = sorted(
+            shortlist,
+            key=lambda user_id: (
+                -similarity(mask_grams, word_trigrams(self._names[user_id])),
+                self._users[user_id].username,
+            ),
+        )[:limit]
+        return [self._users[user_id] for user_id in ranked]
@@ -0,0 +1,58 @@
+"""Production server: gunicorn managing uvicorn workers.
+
+    gunicorn main:app -c gunicorn.conf.py
+
+Every worker is a separate process with its own event loop (uvloop) and
+HTTP parser (httptools), both picked by UvicornWorker when uvicorn[standard]
+is installed. The app is imported in each worker after the fork, so the
+database clients, caches and the Kafka producer are never shared between
+processes; the FastAPI lifespan then connects and prewarms them per worker.
+
+For development, run `UVICORN_RELOAD=true python main.py` instead.
+"""
+import multiprocessing
+import os
+import shutil
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+# One event loop per core; the workers do not block on I/O
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+
+# Longer than the load balancer's idle timeout, so it closes connections first
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 75))
+# Pending connections the kernel queues while every worker is busy
+backlog = int(os.getenv("GUNICORN_BACKLOG", 2048))
+# Recycle workers now and then to bound slow leaks; the jitter keeps them
+# from all restarting at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 1000))
+# On SIGTERM a worker stops accepting, finishes in-flight requests and runs
+# the lifespan shutdown; whatever is still running after this is killed
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+
+# Import the app in the workers, not in the master: the clients it creates
+# at import time must not be inherited across fork
+preload_app = False
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+
+# bcrypt threads per worker: by default every worker would start one per core
+os.environ.setdefault("PASSWORD_HASH_WORKERS", str(max(multiprocessing.cpu_count() // workers, 1)))
+
+# /metrics is answered by whichever worker gets the scrape; prometheus_client
+# aggregates the counters and histograms of all workers through this directory
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+def on_starting(server):
+    # Files left by a previous master would be added to the new totals
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,103 @@
+"""Connection prewarming and health checks for the API's backends.
+
+The clients in db.* are created at import time but connect lazily, so
+without prewarming the first requests after a deploy pay for the TCP and
+auth handshakes. The lifespan in main opens the pools up front with
+prewarm_backends() and reports readiness from check_backends().
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict
+
+from sqlalchemy import text
+
+from db import database, mongodb
+from db.kafka_client import get_kafka_producer, kafka_producer_started
+from db.redis_client import redis_client
+
+# Connections opened per pool at startup
+DB_PREWARM_CONNECTIONS = int(os.getenv("DB_PREWARM_CONNECTIONS", database.DB_POOL_SIZE))
+MONGODB_PREWARM_CONNECTIONS = int(os.getenv("MONGODB_PREWARM_CONNECTIONS", mongodb.MONGODB_MIN_POOL_SIZE))
+REDIS_PREWARM_CONNECTIONS = int(os.getenv("REDIS_PREWARM_CONNECTIONS", 10))
+# Per startup step; every step together must stay well under the gunicorn
+# worker timeout, or a worker is killed while its backends are down
+PREWARM_TIMEOUT = float(os.getenv("PREWARM_TIMEOUT", 10))
+# Per backend; /readyz answers within this even if one of them hangs
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", 1))
+# Kafka only serves POST /services, an outage there does not take the API out of rotation
+CRITICAL_BACKENDS = ("postgres", "mongo", "redis")
+
+async def ping_postgres():
+    async with database.engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+async def ping_mongo():
+    await mongodb.client.admin.command("ping")
+
+async def ping_redis():
+    await redis_client.client.ping()
+
+async def ping_kafka():
+    await get_kafka_producer()
+
+async def check_kafka():
+    # Readiness only looks at the producer: connecting it here would start
+    # one on every probe while Kafka is down. POST /services connects on demand
+    if not kafka_producer_started():
+        raise ConnectionError("Kafka producer is not connected")
+
+PINGS: Dict[str, Callable[[], Awaitable]] = {
+    "postgres": ping_postgres,
+    "mongo": ping_mongo,
+    "redis": ping_redis,
+    "kafka": ping_kafka,
+}
+
+# What /readyz runs; the same as PINGS except for Kafka
+CHECKS: Dict[str, Callable[[], Awaitable]] = dict(PINGS, kafka=check_kafka)
+
+async def _prewarm(name: str, connections: int):
+    # Concurrent pings each check out their own connection, so the pool
+    # opens `connections` of them and keeps them for the first requests
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(PINGS[name]() for _ in range(max(connections, 1)))), PREWARM_TIMEOUT
+        )
+        print(f"Prewarmed {name}: {connections} connections")
+    except Exception as e:
+        # Not fatal: the pool connects on demand and /readyz reports the outage
+        print(f"Could not prewarm {name}: {e!r}")
+
+async def prewarm_backends():
+    await asyncio.gather(
+        _prewarm("postgres", DB_PREWARM_CONNECTIONS),
+        _prewarm("mongo", MONGODB_PREWARM_CONNECTIONS),
+        _prewarm("redis", REDIS_PREWARM_CONNECTIONS),
+        _prewarm("kafka", 1),
+    )
+
+async def run_startup_step(description: str, step: Awaitable[Any]):
+    """Await one step of the startup within PREWARM_TIMEOUT.
+
+    A step that fails or times out is logged and skipped: the worker starts
+    anyway and /readyz reports whatever backend is missing.
+    """
+    try:
+        await asyncio.wait_for(step, PREWARM_TIMEOUT)
+    except Exception as e:
+        print(f"Could not {description}: {e!r}")
+
+async def _check(name: str) -> str:
+    try:
+        await asyncio.wait_for(CHECKS[name](), READINESS_TIMEOUT)
+        return "ok"
+    except Exception as e:
+        return f"error: {e!r}"
+
+async def check_backends() -> Dict[str, str]:
+    """Status of every backend, checked concurrently."""
+    statuses = await asyncio.gather(*map(_check, CHECKS))
+    return dict(zip(CHECKS, statuses))
+
+def backends_ready(statuses: Dict[str, str]) -> bool:
+    return all(statuses[name] == "ok" for name in CRITICAL_BACKENDS)
@@ -1,41 +1,180 @@
+import asyncio
 import os
 import uuid
-from typing import List, Optional
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import Any, Dict, List, Optional, Set, Tuple
 from datetime import datetime, timedelta
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import Body, FastAPI, Depends, HTTPException, Query, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
 import uvicorn
 
-from db.database import get_db
+from db.database import SessionLocal, engine, get_db
 from db.models import User as UserModel
 from db.mongodb import (
-    ServiceMongo, OrderMongo,
-    create_service, get_services, get_service,
-    create_order, get_orders, get_order, update_order_services
+    client as mongo_client,
+    ServiceMongo, OrderMongo, OrderItem as OrderItemMongo,
+    create_service, find_service_documents, iter_services,
+    create_order, find_order_documents, iter_orders, get_order,
+    update_order_services, add_order_services, remove_order_services, get_user_order_stats
 )
-from db.cache_decorators import cache_read_through, cache_write_through
+from db.mongo_indexes import ensure_indexes
+from db.service_catalog import service_catalog
+from db.order_projection import backfill_order, order_items
+from db.catalog_snapshot import CatalogSnapshot, etag_matches
+from db.cache_decorators import build_cache_key, cache_read_through, cache_write_through, drain_background_tasks
+from db.cache_invalidation import invalidate_namespaces
+from db.cache_codecs import OrmCodec
 from db.redis_client import redis_client
-from db.kafka_client import get_kafka_producer, SERVICE_TOPIC
+from db.tiered_cache import tiered_cache
+from db.user_search_index import UserSearchIndex
+from principal_cache import principal_cache
+from password_hashing import password_hasher, PasswordPoolSaturated
+from pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER,
+    decode_cursor, encode_cursor, json_list_response, ndjson_response, wants_ndjson
+)
+from batch import (
+    BatchItemResult, BatchResult, batch_response, check_batch_size, chunks, drop_duplicates, validate_items
+)
+from db.instrumentation import timed
+from metrics import MetricsMiddleware, metrics_response, register_collectors
+from lifecycle import backends_ready, check_backends, prewarm_backends, run_startup_step
+from db.kafka_client import get_kafka_producer, stop_kafka_producer, SERVICE_TOPIC
+from aiokafka.errors import KafkaError
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# "postgres" runs a trigram-indexed ILIKE; "ngram" serves /users/search from
+# an in-process index, which suits small deployments
+USER_SEARCH_BACKEND = os.getenv("USER_SEARCH_BACKEND", "postgres")
+USER_SEARCH_REFRESH_INTERVAL = float(os.getenv("USER_SEARCH_REFRESH_INTERVAL", 30))
+USER_SEARCH_DEFAULT_LIMIT = 50
+USER_SEARCH_MAX_LIMIT = 500
+
+# Recent logins, preloaded into the user cache when a worker starts
+HOT_USERS_KEY = "hot_users"
+HOT_USERS_PRELOAD = int(os.getenv("HOT_USERS_PRELOAD", 1000))
+CACHE_LISTEN_TIMEOUT = 5
+# Longest wait for background cache refreshes on shutdown
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 10))
+
+user_codec = OrmCodec(UserModel)
+user_search_index = UserSearchIndex() if USER_SEARCH_BACKEND == "ngram" else None
+
+# user:<name> is read on every authenticated request, keep plenty of them in L1
+tiered_cache.configure("user", max_entries=10000, max_bytes=16 * 1024 * 1024, ttl=60)
+tiered_cache.configure("users", max_entries=16, max_bytes=32 * 1024 * 1024, ttl=30)
+tiered_cache.configure("users_search", max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=30)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+async def refresh_user_search_index():
+    # Picks up users created through other workers
+    while True:
+        await asyncio.sleep(USER_SEARCH_REFRESH_INTERVAL)
+        try:
+            async with SessionLocal() as db:
+                await user_search_index.refresh(db)
+        except Exception as e:
+            print(f"Error refreshing user search index: {e}")
+
+async def start_user_search_index(app: FastAPI):
+    if user_search_index is not None:
+        # Started first: if the initial load times out, the refresher
+        # completes it from the watermark reached so far
+        app.state.user_search_refresher = asyncio.create_task(refresh_user_search_index())
+        async with SessionLocal() as db:
+            await user_search_index.refresh(db)
+
+async def preload_caches():
+    """Fill this worker's caches so the first requests after a deploy hit them."""
+    # GET /services needs only Redis and Mongo
+    await catalog_snapshot.get()
+    # The in-process caches stay empty until invalidations can reach them
+    if not await tiered_cache.wait_listening(CACHE_LISTEN_TIMEOUT):
+        return
+
+    # The catalog that prices orders
+    loaded = 0
+    async for service in iter_services():
+        service_catalog.put(service)
+        loaded += 1
+        if loaded >= service_catalog.max_size:
+            break
+    print(f"Preloaded {loaded} services")
+
+    # Users who logged in lately, from Redis into L1 in one MGET; the ones
+    # Redis no longer has are read from Postgres through get_user
+    usernames = await redis_client.most_recent(HOT_USERS_KEY, HOT_USERS_PRELOAD)
+    if not usernames:
+        return
+    cached = await tiered_cache.get_many([build_cache_key("user", username) for username in usernames])
+    async with SessionLocal() as db:
+        for username, value in zip(usernames, cached):
+            if value is None:
+                await get_user(db, username)
+    print(f"Preloaded {len(usernames)} users")
+
+async def close_connections(app: FastAPI):
+    if getattr(app.state, "user_search_refresher", None) is not None:
+        app.state.user_search_refresher.cancel()
+    await drain_background_tasks(SHUTDOWN_TIMEOUT)
+    # Delivers the service commands still buffered
+    await stop_kafka_producer()
+    await tiered_cache.stop()
+    await redis_client.close()
+    mongo_client.close()
+    await engine.dispose()
+    password_hasher.shutdown()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in every worker process, after it has started
+    app.state.ready = False
+    tiered_cache.start()
+    await prewarm_backends()
+    await run_startup_step("create indexes", ensure_indexes())
+    await run_startup_step("load user search index", start_user_search_index(app))
+    await run_startup_step("preload caches", preload_caches())
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        # Out of rotation first, then close what the remaining requests no longer need
+        app.state.ready = False
+        await close_connections(app)
+
 app = FastAPI(
     title="Service Ordering API",
     description="API for ordering services with JWT authentication",
-    version="1.0.0"
+    version="1.0.0",
+    # Single-object endpoints still go through response_model, then orjson
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
+@app.exception_handler(PasswordPoolSaturated)
+async def password_pool_saturated_handler(request, exc):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many authentication requests, retry later"},
+        headers={"Retry-After": "1"},
+    )
+
+register_collectors(engine)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -43,18 +182,19 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 class UserBase(BaseModel):
-    username: str
-    full_name: Optional[str] = None
+    # Column sizes of the users table
+    username: str = Field(max_length=50)
+    full_name: Optional[str] = Field(default=None, max_length=100)
     disabled: Optional[bool] = None
 
 class UserCreate(UserBase):
     password: str
 
 class User(UserBase):
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ServiceBase(BaseModel):
     name: str
@@ -68,8 +208,7 @@ class Service(ServiceBase):
     id: str
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class OrderBase(BaseModel):
     services: List[str]
@@ -77,14 +216,40 @@ class OrderBase(BaseModel):
 class OrderCreate(OrderBase):
     pass
 
+class OrderItem(BaseModel):
+    id: str
+    name: str
+    price: float
+
 class Order(OrderBase):
     id: str
     user_id: str
+    # Service name and price as ordered; empty for orders not yet backfilled
+    items: List[OrderItem] = []
     total_price: float
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class OrderSummary(BaseModel):
+    user_id: str
+    order_count: int
+    service_count: int
+    total_spent: float
+    # None until the user's first order
+    updated_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+# List endpoints serialize through these instead of response_model, see
+# json_list_response
+users_serializer = TypeAdapter(List[User])
+services_serializer = TypeAdapter(List[Service])
+orders_serializer = TypeAdapter(List[Order])
+
+catalog_snapshot = CatalogSnapshot(
+    lambda services: services_serializer.dump_json(services_serializer.validate_python(services))
+)
 
 class Token(BaseModel):
     access_token: str
@@ -93,21 +258,25 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+class Principal(BaseModel):
+    username: str
+
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
-@cache_read_through(prefix="user", ttl=3600)
-async def get_user(db: Session, username: str):
-    return db.query(UserModel).filter(UserModel.username == username).first()
+@cache_read_through(prefix="user", ttl=3600, key=("username",), codec=user_codec)
+async def get_user(db: AsyncSession, username: str):
+    result = await db.execute(select(UserModel).where(UserModel.username == username))
+    return result.scalars().first()
 
-async def authenticate_user(db: Session, username: str, password: str):
+async def authenticate_user(db: AsyncSession, username: str, password: str):
     user = await get_user(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -121,12 +290,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # Fast path: token already verified by this worker and not revoked since
+    username = principal_cache.get(token)
+    if username is not None:
+        return Principal(username=username)
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -135,13 +309,20 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = await get_user(db, username=token_data.username)
-    if user is None:
+
+    # The session only checks out a connection if the user is not cached
+    generation = principal_cache.generation
+    async with SessionLocal() as db:
+        user = await get_user(db, username=token_data.username)
+    if user is None or user.disabled:
         raise credentials_exception
-    return user
+
+    if payload.get("exp") is not None:
+        principal_cache.put(token, user.username, payload["exp"], generation)
+    return Principal(username=user.username)
 
 @app.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
@@ -149,15 +330,18 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    await redis_client.remember(HOT_USERS_KEY, user.username, HOT_USERS_PRELOAD)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
-@cache_write_through(prefix="user", invalidate_pattern="*")
-async def create_user_in_db(db: Session, user: UserCreate):
-    hashed_password = get_password_hash(user.password)
+@cache_write_through(
+    prefix="user", invalidates=("users",), key=lambda user: user.username, codec=user_codec, ttl=3600
+)
+async def create_user_in_db(db: AsyncSession, user: UserCreate):
+    hashed_password = await get_password_hash(user.password)
     db_user = UserModel(
         username=user.username,
         full_name=user.full_name,
@@ -165,84 +349,369 @@ async def create_user_in_db(db: Session, user: UserCreate):
         disabled=user.disabled
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @app.post("/users", response_model=User)
-async def create_user(user: UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     db_user = await get_user(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    return await create_user_in_db(db, user)
+    db_user = await create_user_in_db(db, user)
+    if user_search_index is not None:
+        user_search_index.add(db_user.username, db_user.full_name, db_user.disabled)
+    return db_user
 
-@cache_read_through(prefix="users", ttl=3600)
-async def get_all_users_from_db(db: Session):
-    return db.query(UserModel).all()
+async def insert_users(db: AsyncSession, rows: List[dict]) -> Set[str]:
+    # One multi-row INSERT per chunk; usernames taken since the existence
+    # check are skipped instead of failing the whole statement
+    result = await db.execute(
+        pg_insert(UserModel).values(rows)
+        .on_conflict_do_nothing(index_elements=[UserModel.username])
+        .returning(UserModel.username)
+    )
+    await db.commit()
+    return set(result.scalars().all())
 
-@app.get("/users/all", response_model=List[User])
-async def get_all_users(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return await get_all_users_from_db(db)
+async def create_users_chunk(db: AsyncSession, users: List[Tuple[int, UserCreate]]) -> List[BatchItemResult]:
+    result = await db.execute(
+        select(UserModel.username).where(UserModel.username.in_([user.username for _, user in users]))
+    )
+    existing = set(result.scalars().all())
+    results = [
+        BatchItemResult(index=index, status="exists", id=user.username, detail="Username already registered")
+        for index, user in users if user.username in existing
+    ]
+    # bcrypt is the expensive part: only new users are hashed, on every worker at once
+    pending = [(index, user) for index, user in users if user.username not in existing]
+    hashed_passwords = await password_hasher.hash_many([user.password for _, user in pending])
+
+    rows, hashed = [], []
+    for (index, user), hashed_password in zip(pending, hashed_passwords):
+        if isinstance(hashed_password, Exception):
+            results.append(BatchItemResult(index=index, status="failed", id=user.username,
+                                           detail="Password could not be hashed, retry later"))
+            continue
+        rows.append(dict(username=user.username, full_name=user.full_name,
+                         hashed_password=hashed_password, disabled=bool(user.disabled)))
+        hashed.append((index, user))
+    inserted = await insert_users(db, rows) if rows else set()
+
+    for index, user in hashed:
+        if user.username in inserted:
+            results.append(BatchItemResult(index=index, status="created", id=user.username))
+            if user_search_index is not None:
+                user_search_index.add(user.username, user.full_name, bool(user.disabled))
+        else:
+            results.append(BatchItemResult(index=index, status="exists", id=user.username,
+                                           detail="Username already registered"))
+    if inserted:
+        await invalidate_namespaces("users")
+    return results
+
+@app.post("/users/batch", response_model=BatchResult)
+async def create_users_batch(
+    request: Request,
+    users: List[Dict[str, Any]] = Body(...),
+    current_user: Principal = Depends(get_current_user)
+):
+    """Create many users; results per item, streamed per chunk with Accept: application/x-ndjson."""
+    check_batch_size(users)
+    valid, invalid = validate_items(UserCreate, users)
+    valid, repeated = drop_duplicates(valid, "username")
+
+    async def results():
+        if invalid or repeated:
+            yield invalid + repeated
+        # Own session: with NDJSON the chunks are written after the endpoint returns
+        async with SessionLocal() as db:
+            for chunk in chunks(valid):
+                try:
+                    chunk_results = await create_users_chunk(db, chunk)
+                except DBAPIError as e:
+                    # Nothing of the chunk was committed; the next ones still run
+                    await db.rollback()
+                    print(f"Error creating users: {e!r}")
+                    chunk_results = [
+                        BatchItemResult(index=index, status="failed", id=user.username, detail="Users could not be stored")
+                        for index, user in chunk
+                    ]
+                yield chunk_results
+    return await batch_response(request, results())
+
+# Every worker asks for the full list at once when it expires: load it in one
+# worker only and keep serving the previous list while it is refreshed
+@cache_read_through(
+    prefix="users", ttl=3600, key=(), codec=user_codec, namespaces=("users",),
+    stale_ttl=300, early_expiration=1.0, lock=True
+)
+async def get_all_users_from_db(db: AsyncSession):
+    result = await db.execute(select(UserModel))
+    return result.scalars().all()
+
+async def get_users_page(db: AsyncSession, after: Optional[str], limit: int):
+    query = select(UserModel).order_by(UserModel.username).limit(limit)
+    if after is not None:
+        query = query.where(UserModel.username > after)
+    result = await db.execute(query)
+    return result.scalars().all()
+
+async def stream_users(after: Optional[str] = None):
+    # Own session: the response body is produced after the endpoint returns
+    async with SessionLocal() as db:
+        query = select(UserModel).order_by(UserModel.username).execution_options(yield_per=DEFAULT_PAGE_SIZE)
+        if after is not None:
+            query = query.where(UserModel.username > after)
+        result = await db.stream(query)
+        async for user in result.scalars():
+            yield user
 
-@cache_read_through(prefix="users_search", ttl=3600)
-async def search_users_from_db(db: Session, name_mask: str):
-    return db.query(UserModel).filter(UserModel.full_name.ilike(f"%{name_mask}%")).all()
+@app.get("/users/all", response_model=List[User])
+async def get_all_users(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    after_username = decode_cursor(after, 1)[0] if after else None
+    if wants_ndjson(request):
+        return ndjson_response(stream_users(after_username), lambda user: User.model_validate(user).model_dump_json())
+    if limit is None and after_username is None:
+        return json_list_response(users_serializer, await get_all_users_from_db(db))
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    users = await get_users_page(db, after_username, limit)
+    headers = {NEXT_CURSOR_HEADER: encode_cursor(users[-1].username)} if len(users) == limit else None
+    return json_list_response(users_serializer, users, headers)
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+@cache_read_through(
+    prefix="users_search", ttl=3600, key=("name_mask", "limit"), codec=user_codec, namespaces=("users",)
+)
+async def search_users_from_db(db: AsyncSession, name_mask: str, limit: int = USER_SEARCH_DEFAULT_LIMIT):
+    # Served by the idx_users_full_name_trgm GIN index; best matches first
+    result = await db.execute(
+        select(UserModel)
+        .where(UserModel.full_name.ilike(f"%{escape_like(name_mask)}%", escape="\\"))
+        .order_by(func.similarity(UserModel.full_name, name_mask).desc(), UserModel.username)
+        .limit(limit)
+    )
+    return result.scalars().all()
 
 @app.get("/users/search", response_model=List[User])
-async def search_users(name_mask: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return await search_users_from_db(db, name_mask)
+async def search_users(
+    name_mask: str,
+    limit: int = Query(USER_SEARCH_DEFAULT_LIMIT, ge=1, le=USER_SEARCH_MAX_LIMIT),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    if user_search_index is not None:
+        # Renamed or disabled users; new ones arrive with the periodic refresh
+        await user_search_index.refresh_changed(db)
+        return user_search_index.search(name_mask, limit)
+    return await search_users_from_db(db, name_mask, limit)
 
 @app.get("/users/{username}", response_model=User)
-async def get_user_by_username(username: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_user_by_username(username: str, db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     user = await get_user(db, username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    # Liveness: the worker's event loop answers; backends are checked by /readyz
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    # Not ready until the lifespan has prewarmed and preloaded, nor once shutdown began
+    backends = await check_backends()
+    started = getattr(app.state, "ready", False)
+    ready = started and backends_ready(backends)
+    return ORJSONResponse(
+        {"status": "ready" if ready else "unavailable", "started": started, "backends": backends},
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return metrics_response()
+
+@app.get("/cache/stats")
+async def get_cache_stats(current_user: Principal = Depends(get_current_user)):
+    return tiered_cache.stats()
+
+@app.get("/password-hashing/stats")
+async def get_password_hashing_stats(current_user: Principal = Depends(get_current_user)):
+    return password_hasher.stats()
+
 @app.post("/services", response_model=Service)
-async def create_service_endpoint(service: ServiceCreate, current_user: User = Depends(get_current_user)):
-    # Create service command
-    service_data = service.dict()
+async def create_service_endpoint(service: ServiceCreate, current_user: Principal = Depends(get_current_user)):
+    # Create service command; the id is assigned here so the response matches
+    # what the processor stores and redeliveries upsert the same document
+    service_mongo = ServiceMongo(**service.model_dump())
     
-    # Send command to Kafka
-    producer = get_kafka_producer()
-    producer.send(SERVICE_TOPIC, value=service_data)
-    producer.flush()
+    # Send command to Kafka, keyed by service id so all commands for one
+    # service land on the same partition, and wait for the broker ack
+    try:
+        producer = await get_kafka_producer()
+        with timed("kafka", "send_and_wait"):
+            await producer.send_and_wait(
+                SERVICE_TOPIC, value=service_mongo.model_dump(mode="json"), key=service_mongo.id
+            )
+    except KafkaError:
+        raise HTTPException(status_code=503, detail="Service command queue is unavailable")
     
-    # Create temporary service object for response
-    service_mongo = ServiceMongo(**service_data)
     return service_mongo
 
+async def publish_services(services: List[Tuple[int, ServiceCreate]]) -> List[BatchItemResult]:
+    commands = [(index, ServiceMongo(**service.model_dump())) for index, service in services]
+    try:
+        producer = await get_kafka_producer()
+    except KafkaError:
+        # Nothing was queued
+        return [
+            BatchItemResult(index=index, status="failed", id=service.id, detail="Service command queue is unavailable")
+            for index, service in commands
+        ]
+
+    with timed("kafka", "send_batch"):
+        # Queue the whole chunk before waiting: the producer packs it into
+        # a few batched requests instead of a round trip per service. A send
+        # that fails only fails its own item; the ones queued before it are
+        # still delivered and reported from their own futures
+        deliveries = []
+        for _, service in commands:
+            try:
+                deliveries.append(
+                    await producer.send(SERVICE_TOPIC, value=service.model_dump(mode="json"), key=service.id)
+                )
+            except KafkaError as e:
+                deliveries.append(e)
+        acks = await asyncio.gather(
+            *(delivery for delivery in deliveries if not isinstance(delivery, Exception)), return_exceptions=True
+        )
+
+    acks = iter(acks)
+    results = []
+    for (index, service), delivery in zip(commands, deliveries):
+        ack = delivery if isinstance(delivery, Exception) else next(acks)
+        if isinstance(ack, Exception):
+            results.append(BatchItemResult(index=index, status="failed", id=service.id,
+                                           detail="Service command queue is unavailable"))
+        else:
+            results.append(BatchItemResult(index=index, status="accepted", id=service.id))
+    return results
+
+@app.post("/services/batch", response_model=BatchResult)
+async def create_services_batch_endpoint(
+    request: Request,
+    services: List[Dict[str, Any]] = Body(...),
+    current_user: Principal = Depends(get_current_user)
+):
+    """Send a create command per service; results per item, streamed per chunk with Accept: application/x-ndjson."""
+    check_batch_size(services)
+    valid, invalid = validate_items(ServiceCreate, services)
+
+    async def results():
+        if invalid:
+            yield invalid
+        for chunk in chunks(valid):
+            yield await publish_services(chunk)
+    return await batch_response(request, results())
+
 @app.get("/services", response_model=List[Service])
-async def get_services_endpoint(current_user: User = Depends(get_current_user)):
-    services = await get_services()
-    return services
+async def get_services_endpoint(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user)
+):
+    after_id = decode_cursor(after, 1)[0] if after else None
+    if wants_ndjson(request):
+        return ndjson_response(iter_services(after_id), lambda service: service.model_dump_json())
+    if limit is None and after_id is None:
+        # Clients polling the whole catalog revalidate with If-None-Match
+        snapshot = await catalog_snapshot.get()
+        headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), snapshot.etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(snapshot.body, media_type="application/json", headers=headers)
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    services = await find_service_documents(after_id, limit)
+    headers = {NEXT_CURSOR_HEADER: encode_cursor(services[-1]["id"])} if len(services) == limit else None
+    return json_list_response(services_serializer, services, headers)
+
+async def catalog_prices(service_ids: List[str]) -> Dict[str, float]:
+    services, missing = await service_catalog.get_many(service_ids)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Service {missing[0]} not found")
+    return {service_id: service.price for service_id, service in services.items()}
+
+async def catalog_items(service_ids: List[str]) -> List[OrderItemMongo]:
+    services, missing = await service_catalog.get_many(service_ids)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Service {missing[0]} not found")
+    return order_items(service_ids, services)
 
 @app.post("/orders", response_model=Order)
-async def create_order_endpoint(order: OrderCreate, current_user: User = Depends(get_current_user)):
-    total_price = 0
-    for service_id in order.services:
-        service = await get_service(service_id)
-        if not service:
-            raise HTTPException(status_code=404, detail=f"Service {service_id} not found")
-        total_price += service.price
+async def create_order_endpoint(order: OrderCreate, current_user: Principal = Depends(get_current_user)):
+    # Names and prices are embedded so reading the order needs no catalog
+    items = await catalog_items(order.services)
 
     order_mongo = OrderMongo(
         user_id=current_user.username,
         services=order.services,
-        total_price=total_price
+        items=items,
+        total_price=sum(item.price for item in items)
     )
     created_order = await create_order(order_mongo)
     return created_order
 
+def decode_orders_cursor(after: Optional[str]):
+    if not after:
+        return None
+    created_at, order_id = decode_cursor(after, 2)
+    try:
+        return datetime.fromisoformat(created_at), order_id
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
 @app.get("/orders", response_model=List[Order])
-async def get_orders_endpoint(current_user: User = Depends(get_current_user)):
-    orders = await get_orders(current_user.username)
-    return orders
+async def get_orders_endpoint(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user)
+):
+    after_key = decode_orders_cursor(after)
+    if wants_ndjson(request):
+        return ndjson_response(iter_orders(current_user.username, after_key), lambda order: order.model_dump_json())
+    if limit is None and after_key is None:
+        return json_list_response(orders_serializer, await find_order_documents(current_user.username))
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    orders = await find_order_documents(current_user.username, after_key, limit)
+    headers = None
+    if len(orders) == limit:
+        headers = {NEXT_CURSOR_HEADER: encode_cursor(orders[-1]["created_at"].isoformat(), orders[-1]["id"])}
+    return json_list_response(orders_serializer, orders, headers)
+
+# Declared before /orders/{order_id} so "summary" is not taken for an id
+@app.get("/orders/summary", response_model=OrderSummary)
+async def get_orders_summary_endpoint(current_user: Principal = Depends(get_current_user)):
+    # One document kept up to date on every order write, not a scan of the orders
+    return await get_user_order_stats(current_user.username)
 
 @app.get("/orders/{order_id}", response_model=Order)
-async def get_order_endpoint(order_id: str, current_user: User = Depends(get_current_user)):
+async def get_order_endpoint(order_id: str, current_user: Principal = Depends(get_current_user)):
     order = await get_order(order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -250,27 +719,40 @@ async def get_order_endpoint(order_id: str, current_user: User = Depends(get_cur
         raise HTTPException(status_code=403, detail="Not authorized to access this order")
     return order
 
+class OrderServicesMode(str, Enum):
+    replace = "replace"
+    append = "append"
+    remove = "remove"
+
 @app.put("/orders/{order_id}/services", response_model=Order)
 async def add_services_to_order_endpoint(
     order_id: str,
     service_ids: List[str],
-    current_user: User = Depends(get_current_user)
+    mode: OrderServicesMode = OrderServicesMode.replace,
+    current_user: Principal = Depends(get_current_user)
 ):
-    order = await get_order(order_id)
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    if order.user_id != current_user.username:
-        raise HTTPException(status_code=403, detail="Not authorized to modify this order")
-
-    total_price = 0
-    for service_id in service_ids:
-        service = await get_service(service_id)
-        if not service:
-            raise HTTPException(status_code=404, detail=f"Service {service_id} not found")
-        total_price += service.price
+    # Prices come from the catalog cache; the order itself is checked and
+    # changed in a single find_one_and_update
+    if mode == OrderServicesMode.remove:
+        prices = await catalog_prices(service_ids)
+        updated_order = await remove_order_services(order_id, current_user.username, prices)
+    elif mode == OrderServicesMode.append:
+        items = await catalog_items(service_ids)
+        # An order from before items existed would get items for the new
+        # services only; a no-op read on any other order
+        await backfill_order(order_id, current_user.username)
+        updated_order = await add_order_services(order_id, current_user.username, items)
+    else:
+        items = await catalog_items(service_ids)
+        updated_order = await update_order_services(order_id, current_user.username, items)
 
-    updated_order = await update_order_services(order_id, service_ids, total_price)
+    if updated_order is None:
+        # Only the failure path pays for a second read, to tell 404 from 403
+        if await get_order(order_id) is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        raise HTTPException(status_code=403, detail="Not authorized to modify this order")
     return updated_order
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # Development server; production runs gunicorn with gunicorn.conf.py
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=os.getenv("UVICORN_RELOAD", "false").lower() == "true")
\ No newline at end of file
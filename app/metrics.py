@@ -0,0 +1,137 @@
+"""Prometheus metrics of the API and service_processor.
+
+Latency of every backend call is recorded as it happens (db.instrumentation).
+Figures that already exist as counters elsewhere (tiered cache hits, the
+bcrypt pool, connection pools) are read only when /metrics is scraped.
+
+Under gunicorn (PROMETHEUS_MULTIPROC_DIR set) the metrics above are summed
+over all workers, while the scrape-time collectors describe the worker that
+answered the scrape.
+"""
+import os
+import time
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+
+from db.instrumentation import LATENCY_BUCKETS
+from db.redis_client import redis_client
+from db.tiered_cache import tiered_cache
+from password_hashing import LATENCY_BUCKETS as HASH_LATENCY_BUCKETS, password_hasher
+
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_seconds", "Latency of API requests by route template",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "API requests being handled", ["method"], multiprocess_mode="livesum"
+)
+CONSUMER_LAG = Gauge("kafka_consumer_lag", "Records behind the end of the partition", ["topic", "partition"])
+
+class MetricsMiddleware:
+    """Times requests; labelled by route template so ids do not blow up cardinality."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.labels(method).inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.labels(method).dec()
+            # The router stores the matched route in the shared scope
+            route = scope.get("route")
+            HTTP_REQUEST_LATENCY.labels(
+                method, route.path if route is not None else "unmatched", str(status)
+            ).observe(time.perf_counter() - started)
+
+class CacheCollector:
+    def collect(self):
+        requests = CounterMetricFamily(
+            "cache_requests", "Tiered cache lookups by key prefix", labels=["prefix", "level", "result"]
+        )
+        entries = GaugeMetricFamily("cache_l1_entries", "Entries in the in-process cache", labels=["prefix"])
+        size = GaugeMetricFamily("cache_l1_bytes", "Bytes held by the in-process cache", labels=["prefix"])
+        for prefix, stats in tiered_cache.stats().items():
+            for level in ("l1", "l2"):
+                requests.add_metric([prefix, level, "hit"], stats[f"{level}_hits"])
+                requests.add_metric([prefix, level, "miss"], stats[f"{level}_misses"])
+            entries.add_metric([prefix], stats["l1_entries"])
+            size.add_metric([prefix], stats["l1_bytes"])
+        yield from (requests, entries, size)
+
+class PasswordHashingCollector:
+    def collect(self):
+        stats = password_hasher.stats()
+        yield GaugeMetricFamily("password_hash_in_flight", "bcrypt operations admitted", value=stats["in_flight"])
+        yield GaugeMetricFamily("password_hash_queued", "bcrypt operations waiting for a worker", value=stats["queued"])
+        yield GaugeMetricFamily("password_hash_saturation", "Share of admission slots in use", value=stats["saturation"])
+        yield CounterMetricFamily("password_hash_rejected", "bcrypt operations shed", value=stats["rejected_total"])
+        yield CounterMetricFamily(
+            "password_hash_wait_seconds", "Time spent waiting for a worker", value=stats["wait_seconds_sum"]
+        )
+        # stats() keeps per-bucket counts, Prometheus wants them cumulative
+        buckets, count = [], 0
+        for le, observed in zip([*map(str, HASH_LATENCY_BUCKETS), "+Inf"], stats["hash_seconds_buckets"].values()):
+            count += observed
+            buckets.append((le, count))
+        yield HistogramMetricFamily(
+            "password_hash_seconds", "Duration of a bcrypt hash or verify", buckets=buckets,
+            sum_value=stats["hash_seconds_sum"],
+        )
+
+class PoolCollector:
+    def __init__(self, engine=None):
+        self.engine = engine
+
+    def collect(self):
+        redis_pool = GaugeMetricFamily("redis_pool_connections", "Redis connection pool", labels=["state"])
+        redis_pool.add_metric(["in_use"], len(redis_client.pool._in_use_connections))
+        redis_pool.add_metric(["idle"], len(redis_client.pool._available_connections))
+        redis_pool.add_metric(["max"], redis_client.pool.max_connections)
+        yield redis_pool
+
+        pool = self.engine.sync_engine.pool if self.engine is not None else None
+        # Only QueuePool has a fixed size; other pools (SQLite) are skipped
+        if pool is not None and hasattr(pool, "checkedout"):
+            db_pool = GaugeMetricFamily("db_pool_connections", "SQLAlchemy connection pool", labels=["state"])
+            db_pool.add_metric(["checked_out"], pool.checkedout())
+            db_pool.add_metric(["idle"], pool.checkedin())
+            db_pool.add_metric(["overflow"], max(pool.overflow(), 0))
+            db_pool.add_metric(["size"], pool.size())
+            yield db_pool
+
+_collectors = []
+
+def register_collectors(engine=None, password_hashing: bool = True):
+    _collectors.extend([CacheCollector(), PoolCollector(engine)])
+    if password_hashing:
+        _collectors.append(PasswordHashingCollector())
+    for collector in _collectors:
+        REGISTRY.register(collector)
+
+def metrics_response() -> Response:
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for collector in _collectors:
+            registry.register(collector)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,27 @@
+"""trigram index for users.full_name substring search
+
+Revision ID: 002
+Revises: 001
+Create Date: 2024-01-01 00:00:00.000000
+
+"""
+from alembic import op
+
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # CONCURRENTLY keeps the users table writable while the index is built,
+    # and cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_full_name_trgm "
+            "ON users USING gin (full_name gin_trgm_ops)"
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_users_full_name_trgm")
@@ -0,0 +1,47 @@
+import base64
+import json
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(*values) -> str:
+    """Opaque keyset cursor: the sort key of the last row of a page."""
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode().rstrip("=")
+
+def decode_cursor(token: str, size: int) -> List[str]:
+    """Values of a cursor from encode_cursor; they are all strings (dates as ISO)."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        values = None
+    if (not isinstance(values, list) or len(values) != size
+            or not all(isinstance(value, str) for value in values)):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return values
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def ndjson_response(rows: AsyncIterator, serialize: Callable[[object], str]) -> StreamingResponse:
+    """Write rows as they come from the database cursor, one JSON document per line."""
+    async def body():
+        async for row in rows:
+            yield serialize(row) + "\n"
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
+
+def json_list_response(serializer: TypeAdapter, rows: Iterable, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Validate and dump a whole page in one pydantic-core call.
+
+    Rows may be ORM objects, models or raw Mongo documents. Returning a
+    Response skips FastAPI's response_model pass, which would build and
+    encode every row again.
+    """
+    content = serializer.dump_json(serializer.validate_python(rows, from_attributes=True))
+    return Response(content, media_type="application/json", headers=headers)
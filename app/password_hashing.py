@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from passlib.context import CryptContext
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+# Requests allowed to wait for a free worker before new ones are rejected
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", 32))
+# "thread" is enough for bcrypt, which releases the GIL while hashing
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.5, 5.0)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _timed(func: Callable, *args) -> Tuple[object, float]:
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+class PasswordPoolSaturated(Exception):
+    """All workers are busy and the wait queue is full."""
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop on a bounded worker pool.
+
+    At most workers + queue_limit operations are admitted at once; anything
+    beyond that fails immediately with PasswordPoolSaturated so a login storm
+    is shed instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_limit: int = PASSWORD_HASH_QUEUE_LIMIT,
+                 executor: str = PASSWORD_HASH_EXECUTOR):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.executor_kind = executor
+        self._executor: Optional[Executor] = None
+        self.in_flight = 0
+        self.rejected_total = 0
+        self.completed_total = 0
+        self.wait_seconds_sum = 0.0
+        self.hash_seconds_sum = 0.0
+        self.hash_seconds_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, func: Callable, *args):
+        if self.in_flight >= self.workers + self.queue_limit:
+            self.rejected_total += 1
+            raise PasswordPoolSaturated()
+
+        self.in_flight += 1
+        submitted = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, hash_seconds = await loop.run_in_executor(self._get_executor(), _timed, func, *args)
+        finally:
+            self.in_flight -= 1
+
+        self.completed_total += 1
+        self.hash_seconds_sum += hash_seconds
+        self.wait_seconds_sum += time.perf_counter() - submitted - hash_seconds
+        self.hash_seconds_buckets[bisect_left(LATENCY_BUCKETS, hash_seconds)] += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, plain_password, hashed_password)
+
+    async def hash_many(self, passwords: List[str]) -> List[Union[str, Exception]]:
+        """Hash on all workers at once, in input order.
+
+        At most `workers` of these are admitted at a time, so a bulk import
+        leaves the wait queue to logins. A password that could not be hashed
+        gets its exception instead of a hash.
+        """
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def hash_one(password: str) -> str:
+            async with semaphore:
+                return await self.hash(password)
+        return await asyncio.gather(*map(hash_one, passwords), return_exceptions=True)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": self.in_flight,
+            "queued": max(self.in_flight - self.workers, 0),
+            "saturation": self.in_flight / (self.workers + self.queue_limit),
+            "rejected_total": self.rejected_total,
+            "completed_total": self.completed_total,
+            "hash_seconds_sum": self.hash_seconds_sum,
+            "wait_seconds_sum": self.wait_seconds_sum,
+            "hash_seconds_buckets": dict(zip([*map(str, LATENCY_BUCKETS), "+Inf"], self.hash_seconds_buckets)),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from db.tiered_cache import tiered_cache
+
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", 100000))
+
+class PrincipalCache:
+    """Verified access tokens of this process, keyed by token hash until exp.
+
+    A hit skips both jwt.decode and the user lookup. Entries of a user are
+    dropped whenever the cached user record (user:<name>) is invalidated in
+    any worker, so disabling or changing a user propagates through the same
+    pub/sub channel as the rest of the cache. While that channel is down the
+    cache is bypassed.
+
+    Users are disabled through user_admin, which broadcasts that
+    invalidation. A lookup racing with it is caught by the generation: read
+    it before loading the user and pass it to put().
+    """
+
+    def __init__(self, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, Tuple[float, str]]" = OrderedDict()
+        self._by_user: Dict[str, Set[bytes]] = {}
+        # Bumped by every invalidation of a user or of the whole cache
+        self.generation = 0
+        tiered_cache.on_invalidate(self._on_cache_invalidate)
+
+    @staticmethod
+    def _token_hash(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[str]:
+        if not tiered_cache.listening:
+            return None
+        token_hash = self._token_hash(token)
+        entry = self._entries.get(token_hash)
+        if entry is None:
+            return None
+        expires_at, username = entry
+        if expires_at <= time.time():
+            self._remove(token_hash)
+            return None
+        self._entries.move_to_end(token_hash)
+        return username
+
+    def put(self, token: str, username: str, expires_at: float, generation: int):
+        # A user invalidated since `generation` was read may have been loaded
+        # from before the change; do not cache a principal from it
+        if not tiered_cache.listening or generation != self.generation:
+            return
+        token_hash = self._token_hash(token)
+        self._remove(token_hash)
+        self._entries[token_hash] = (expires_at, username)
+        self._by_user.setdefault(username, set()).add(token_hash)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def revoke_user(self, username: str):
+        self.generation += 1
+        for token_hash in self._by_user.pop(username, ()):
+            self._entries.pop(token_hash, None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+        self._by_user.clear()
+
+    def _remove(self, token_hash: bytes):
+        entry = self._entries.pop(token_hash, None)
+        if entry is not None:
+            hashes = self._by_user.get(entry[1])
+            if hashes is not None:
+                hashes.discard(token_hash)
+                if not hashes:
+                    del self._by_user[entry[1]]
+
+    def _on_cache_invalidate(self, key: Optional[str]):
+        if key is None:
+            self.clear()
+        elif key.startswith("user:"):
+            self.revoke_user(key[len("user:"):])
+
+principal_cache = PrincipalCache()
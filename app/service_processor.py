@@ -1,34 +1,270 @@
 import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError, PyMongoError
+from aiokafka.errors import CommitFailedError
 from db.kafka_client import get_kafka_consumer
-from db.mongodb import create_service, ServiceMongo
+from db.mongodb import upsert_services, ServiceMongo
+from db.mongo_indexes import ensure_indexes
+from db.order_projection import backfill_order_items, project_services
 from db.redis_client import redis_client
-import json
+from db.cache_invalidation import invalidate_namespaces
+from db.cache_codecs import PydanticCodec
+from db.instrumentation import timed
+from prometheus_client import Counter, start_http_server
+from metrics import CONSUMER_LAG, register_collectors
+
+# Batch is closed when it reaches BATCH_SIZE records or BATCH_TIMEOUT_MS passes
+BATCH_SIZE = int(os.getenv("SERVICE_BATCH_SIZE", 500))
+BATCH_TIMEOUT_MS = int(os.getenv("SERVICE_BATCH_TIMEOUT_MS", 200))
+# Batches fetched ahead while the oldest one is written
+MAX_IN_FLIGHT_BATCHES = int(os.getenv("SERVICE_MAX_IN_FLIGHT_BATCHES", 2))
+REPORT_INTERVAL = float(os.getenv("SERVICE_REPORT_INTERVAL", 10))
+SERVICE_CACHE_TTL = 3600
+# Commands seen within this many seconds are skipped without touching Mongo
+DEDUPE_WINDOW = int(os.getenv("SERVICE_DEDUPE_WINDOW", 600))
+# Prometheus /metrics of this process; 0 turns the endpoint off
+METRICS_PORT = int(os.getenv("SERVICE_METRICS_PORT", 9100))
+
+COMMANDS_PROCESSED = Counter("service_commands_processed", "Service commands written to MongoDB")
+COMMANDS_SKIPPED = Counter("service_commands_skipped", "Service commands dropped as already seen")
+COMMANDS_REJECTED = Counter("service_commands_rejected", "Service commands MongoDB refused to write")
+
+service_codec = PydanticCodec(ServiceMongo)
+
+def command_fingerprint(record) -> str:
+    payload = json.dumps(record.value, sort_keys=True).encode()
+    return f"dedupe:service_command:{record.key}:{hashlib.sha1(payload).hexdigest()}"
+
+def parse_batch(records):
+    # Later commands for the same service id win; dict keeps first-seen order
+    services = {}
+    for record in records:
+        try:
+            if record.value is None:
+                raise ValueError("not a JSON document")
+            service = ServiceMongo(**record.value)
+            services[service.id] = service
+        except (ValidationError, TypeError, ValueError) as e:
+            print(f"Skipping invalid service command at {record.topic}[{record.partition}]@{record.offset}: {e}")
+    return list(services.values())
+
+async def drop_seen_commands(records):
+    # Best effort only: the upsert below keeps redeliveries idempotent even
+    # when a command slips past this window
+    keys = [command_fingerprint(record) for record in records]
+    seen = await redis_client.mget_bytes(keys)
+    fresh = [record for record, mark in zip(records, seen) if mark is None]
+    COMMANDS_SKIPPED.inc(len(records) - len(fresh))
+    return fresh, keys
+
+def is_transient(error: PyMongoError) -> bool:
+    # Per-document write errors (validation, duplicates) fail the same way on
+    # every attempt; retrying them would stall the consumer on one batch
+    if not isinstance(error, BulkWriteError):
+        return True
+    return bool(error.details.get("writeConcernErrors")) or not error.details.get("writeErrors")
+
+async def retry(description: str, operation):
+    delay = 0.5
+    while True:
+        try:
+            return await operation()
+        except PyMongoError as e:
+            if not is_transient(e):
+                raise
+            print(f"Error {description}, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+def rejected_indexes(description: str, error: BulkWriteError, ignored_codes=()) -> set:
+    """Log the documents a bulk write refused; returns their positions in the batch."""
+    if error.details.get("writeConcernErrors"):
+        # Not about the documents: let retry() repeat the whole write
+        raise error
+    rejected = set()
+    for write_error in error.details.get("writeErrors", []):
+        if write_error["code"] in ignored_codes:
+            continue
+        rejected.add(write_error["index"])
+        print(f"Error {description}, dropping operation {write_error['index']}: "
+              f"[{write_error['code']}] {write_error.get('errmsg')}")
+    return rejected
+
+async def write_services(services):
+    """Upsert the batch; returns the services that were stored."""
+    try:
+        await upsert_services(services)
+    except BulkWriteError as e:
+        # 11000: a concurrent upsert of the same id already stored the service
+        rejected = rejected_indexes(f"writing {len(services)} services", e, ignored_codes=(11000,))
+        COMMANDS_REJECTED.inc(len(rejected))
+        return [service for index, service in enumerate(services) if index not in rejected]
+    return services
+
+async def project(services):
+    try:
+        return await project_services(services)
+    except BulkWriteError as e:
+        # Orders that refuse the rename keep the old name; the rest are renamed
+        rejected_indexes(f"projecting {len(services)} services into orders", e)
+        return e.details.get("nModified", 0)
+
+class PreviousBatchFailed(Exception):
+    """A batch fetched earlier was not written, so this one must not be either"""
+
+async def persist_batch(records, previous=None):
+    records, fingerprints = await drop_seen_commands(records)
+    services = parse_batch(records)
+
+    # Commands for one service id can sit in consecutive batches. Writing
+    # starts only when the previous batch is done, so an older command can
+    # never land after a newer one; fetching and the dedupe lookup still
+    # overlap with the previous write.
+    if previous is not None:
+        await asyncio.wait([previous])
+        if previous.cancelled() or previous.exception() is not None:
+            raise PreviousBatchFailed()
+    if not services:
+        return 0
+
+    # Offsets are committed only after this succeeds, so keep retrying
+    # instead of dropping the batch; only commands MongoDB refuses are dropped
+    services = await retry(f"writing batch of {len(services)} services", lambda: write_services(services))
+    if not services:
+        await redis_client.mset_bytes({key: b"1" for key in fingerprints}, DEDUPE_WINDOW)
+        return 0
+    # Order item snapshots follow renamed services
+    await retry(f"projecting {len(services)} services into orders", lambda: project(services))
+
+    # Cache the services in Redis with a single pipeline
+    await redis_client.mset_bytes(
+        {f"service:{service.id}": service_codec.dumps(service) for service in services},
+        SERVICE_CACHE_TTL
+    )
+
+    # Drop every cached view of the services catalog
+    await invalidate_namespaces("services")
+
+    await redis_client.mset_bytes({key: b"1" for key in fingerprints}, DEDUPE_WINDOW)
+    COMMANDS_PROCESSED.inc(len(services))
+    return len(services)
+
+async def consumer_lag(consumer):
+    lag = {}
+    for tp in consumer.assignment():
+        highwater = consumer.highwater(tp)
+        if highwater is not None:
+            lag[tp] = highwater - await consumer.position(tp)
+    return lag
+
+async def update_lag_metrics(consumer):
+    for tp, behind in (await consumer_lag(consumer)).items():
+        CONSUMER_LAG.labels(tp.topic, str(tp.partition)).set(behind)
+
+class ThroughputReport:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.started_at = time.monotonic()
+        self.reported_at = self.started_at
+        self.total = 0
+        self.since_report = 0
+
+    def add(self, count: int):
+        self.total += count
+        self.since_report += count
+
+    async def maybe_report(self, consumer):
+        now = time.monotonic()
+        if now - self.reported_at < self.interval:
+            return
+        lag = {f"{tp.topic}[{tp.partition}]": behind for tp, behind in (await consumer_lag(consumer)).items()}
+        rate = self.since_report / (now - self.reported_at)
+        print(f"Processed {self.total} services total, {rate:.1f}/s over the last "
+              f"{now - self.reported_at:.0f}s, lag {lag}")
+        self.reported_at = now
+        self.since_report = 0
+
+async def commit(consumer, offsets):
+    try:
+        with timed("kafka", "commit"):
+            await consumer.commit(offsets)
+    except CommitFailedError as e:
+        # Partitions were reassigned; the new owner re-reads these records
+        print(f"Could not commit offsets {offsets}: {e}")
+
+async def finish_in_flight(consumer, in_flight, report, commit_offsets: bool):
+    """Wait for the remaining batches, committing in order up to the first failure.
+
+    After a failed batch nothing later is committed, even if it was written:
+    a higher offset would skip the failed records. They are read again from
+    the last committed offset on restart, and the upserts make that safe.
+    """
+    while in_flight:
+        task, offsets = in_flight.popleft()
+        if not commit_offsets:
+            task.cancel()
+        try:
+            count = await task
+        except BaseException as e:
+            if commit_offsets and not isinstance(e, asyncio.CancelledError):
+                print(f"Error persisting batch, offsets {offsets} and later are not committed: {e!r}")
+            commit_offsets = False
+            continue
+        if commit_offsets:
+            report.add(count)
+            await commit(consumer, offsets)
 
 async def process_service_commands():
-    consumer = get_kafka_consumer()
+    # Upserts match on id; without the unique index each one scans the collection
+    await ensure_indexes()
+    filled = await retry("adding items to older orders", backfill_order_items)
+    if filled:
+        print(f"Added service items to {filled} orders")
+    if METRICS_PORT:
+        register_collectors(password_hashing=False)
+        start_http_server(METRICS_PORT)
+
+    consumer = get_kafka_consumer(max_poll_records=BATCH_SIZE)
+    await consumer.start()
     print("Service processor started. Waiting for messages...")
-    
-    for message in consumer:
-        try:
-            service_data = message.value
-            print(f"Received service command: {service_data}")
-            
-            # Create service in MongoDB
-            service_mongo = ServiceMongo(**service_data)
-            created_service = await create_service(service_mongo)
-            
-            # Cache the service in Redis
-            cache_key = f"service:{created_service.id}"
-            await redis_client.set(
-                cache_key,
-                json.dumps(created_service.dict()),
-                ex=3600  # Cache for 1 hour
-            )
-            
-            print(f"Processed service command successfully: {created_service.id}")
-            
-        except Exception as e:
-            print(f"Error processing service command: {str(e)}")
+
+    report = ThroughputReport(REPORT_INTERVAL)
+    in_flight = deque()
+    failed = False
+    try:
+        while True:
+            batches = await consumer.getmany(timeout_ms=BATCH_TIMEOUT_MS, max_records=BATCH_SIZE)
+            records = [record for partition_records in batches.values() for record in partition_records]
+            if records:
+                offsets = {tp: partition_records[-1].offset + 1 for tp, partition_records in batches.items()}
+                previous = in_flight[-1][0] if in_flight else None
+                in_flight.append((asyncio.create_task(persist_batch(records, previous)), offsets))
+
+            # Commit strictly in fetch order: a batch's offsets are committed
+            # only after it and every batch before it were persisted. Up to
+            # MAX_IN_FLIGHT_BATCHES stay in flight during the next fetch.
+            while in_flight and (len(in_flight) > MAX_IN_FLIGHT_BATCHES or in_flight[0][0].done()):
+                task, offsets = in_flight.popleft()
+                try:
+                    count = await task
+                except BaseException:
+                    # Also when cancelled mid-wait: the batch may not be written
+                    failed = True
+                    raise
+                report.add(count)
+                await commit(consumer, offsets)
+
+            await update_lag_metrics(consumer)
+            await report.maybe_report(consumer)
+    finally:
+        await finish_in_flight(consumer, in_flight, report, commit_offsets=not failed)
+        await consumer.stop()
+        await redis_client.close()
 
 if __name__ == "__main__":
-    asyncio.run(process_service_commands()) 
\ No newline at end of file
+    asyncio.run(process_service_commands())
@@ -0,0 +1,74 @@
+"""Disable, re-enable or rename users outside the API.
+
+    python -m user_admin disable alice
+    python -m user_admin enable alice
+    python -m user_admin set-name alice "Alice Liddell"
+
+Every change goes through invalidate_user(), so the cached user record is
+dropped in Redis and in every worker's L1, and the workers' principal
+caches forget the user's tokens: a disabled user is rejected on the next
+request instead of when the token expires. With USER_SEARCH_BACKEND=ngram
+the workers re-read the user into their search index before the next search.
+"""
+import argparse
+import asyncio
+import sys
+
+from sqlalchemy import update
+
+from db.cache_decorators import build_cache_key
+from db.cache_invalidation import invalidate_namespaces
+from db.database import SessionLocal, engine
+from db.models import User
+from db.redis_client import redis_client
+from db.tiered_cache import tiered_cache
+
+# A lookup that read the row just before the change can store it in the
+# cache just after the first invalidation; the second one removes it
+REINVALIDATE_AFTER = 1.0
+
+async def invalidate_user(username: str):
+    """Drop every cached view of a user; call after changing the user in Postgres."""
+    key = build_cache_key("user", username)
+    await redis_client.delete(key)
+    # Evicts the key from L1 in every worker, and with it the user's principals
+    await tiered_cache.invalidate(key)
+    # Lists and searches that contain the user
+    await invalidate_namespaces("users")
+
+async def update_user(username: str, **values) -> bool:
+    """Change a user's columns; False if there is no such user."""
+    async with SessionLocal() as db:
+        result = await db.execute(update(User).where(User.username == username).values(**values))
+        await db.commit()
+    if not result.rowcount:
+        return False
+    await invalidate_user(username)
+    await asyncio.sleep(REINVALIDATE_AFTER)
+    await invalidate_user(username)
+    return True
+
+async def _main(args) -> bool:
+    try:
+        if args.command == "set-name":
+            return await update_user(args.username, full_name=args.full_name)
+        return await update_user(args.username, disabled=args.command == "disable")
+    finally:
+        await redis_client.close()
+        await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    for command in ("disable", "enable"):
+        commands.add_parser(command).add_argument("username")
+    set_name = commands.add_parser("set-name")
+    set_name.add_argument("username")
+    set_name.add_argument("full_name")
+    args = parser.parse_args()
+    if not asyncio.run(_main(args)):
+        print(f"User {args.username} not found")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()